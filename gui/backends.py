@@ -0,0 +1,105 @@
+import time
+import zlib
+import importlib.util
+
+
+# Available inference backends.
+#   nmt -> The model trained with nmt_chatbot.
+#   stub -> Deterministic answers after a fixed delay, to test the server without the model.
+BACKENDS = ('nmt', 'stub')
+
+
+class StubBackend(object):
+    '''Stand-in for the model with the interface of nmt_chatbot.inference.inference: it takes a
+    question, or a list of questions, and returns a result, or the list of their results, after
+    sleeping like the model would. The answer and the delay only depend on the question, so runs
+    are repeatable.
+
+    Usage:
+        inference = StubBackend(latency=0.05)
+        result = inference(question)
+
+    Args:
+        latency -> Default: 0.05. Seconds taken by a call with a single question.
+        batch_latency -> Default: 0.01. Seconds added by every further question of a batch.
+        jitter -> Default: 0. Largest fraction of the latency added to a call, chosen from the
+                  questions.
+    '''
+    def __init__(self, latency=0.05, batch_latency=0.01, jitter=0.0):
+        self.latency = latency
+        self.batch_latency = batch_latency
+        self.jitter = jitter
+
+    def answer(self, question):
+        # Echo the words of the question backwards, like a model that learnt nothing in particular.
+        words = question.split()
+        answer = ' '.join(reversed(words)) if words else '...'
+
+        return {'answers': [answer], 'scores': [1], 'best_index': 0}
+
+    def delay(self, questions):
+        delay = self.latency + self.batch_latency * (len(questions) - 1)
+
+        if self.jitter:
+            # The same questions always get the same delay.
+            delay *= 1 + self.jitter * (zlib.crc32('\n'.join(questions).encode('utf-8')) % 1000) / 1000
+
+        return delay
+
+    def __call__(self, question):
+        questions = question if isinstance(question, list) else [question]
+
+        # Sleeping releases the GIL, like TensorFlow does while it runs the model.
+        time.sleep(self.delay(questions))
+
+        if isinstance(question, list):
+            return [self.answer(q) for q in questions]
+
+        return self.answer(question)
+
+
+def check_backend(name):
+    '''Check that an inference backend exists and that its module can be found, without loading it.
+    Used before forking the workers, which would otherwise be restarted again and again by
+    tornado.process.fork_processes if they all failed to load the backend.
+
+    Args:
+        name -> One of BACKENDS.
+    Raises:
+        ValueError if the backend does not exist or its module cannot be found.
+    '''
+    if name not in BACKENDS:
+        raise ValueError('Unknown inference backend {}, use one of: {}.'.format(name, ', '.join(BACKENDS)))
+
+    if name == 'nmt':
+        # Only the package of nmt_chatbot is imported to find the module, not the model.
+        try:
+            spec = importlib.util.find_spec('nmt_chatbot.inference')
+        except ImportError:
+            spec = None
+
+        if spec is None:
+            raise ValueError('The nmt backend requires nmt_chatbot.inference, which cannot be found.')
+
+
+def load_backend(name, latency=0.05, batch_latency=0.01, jitter=0.0):
+    '''Load an inference backend.
+
+    Args:
+        name -> One of BACKENDS.
+        latency, batch_latency, jitter -> Settings of the stub backend, see StubBackend.
+    Raises:
+        ValueError if the backend does not exist.
+    Returns:
+        Function taking a question, or a list of questions, and returning the result, or the list
+        of their results, as nmt_chatbot.inference.inference does.
+    '''
+    if name == 'nmt':
+        # Only imported when used, since loading it builds the TensorFlow graph.
+        from nmt_chatbot.inference import inference
+
+        return inference
+    elif name == 'stub':
+        return StubBackend(latency, batch_latency, jitter)
+
+    raise ValueError('Unknown inference backend: {}.'.format(name))
@@ -0,0 +1,86 @@
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+
+class MicroBatcher(object):
+    '''Group the questions arriving close together into a single batched inference call. A batch is
+    sent as soon as it holds 'max_batch_size' questions, or 'max_wait' seconds after its first
+    question arrived, whichever comes first. Every caller then gets the answer to its own question.
+
+    Batches are run through an InferenceExecutor whose function takes a list of questions and
+    returns the list of their results, in the same order. The limits of the executor therefore
+    apply to batches: when it is overloaded or times out, every question of the batch fails with
+    the same error.
+
+    Usage:
+        batcher = MicroBatcher(InferenceExecutor(inference), max_batch_size=8, max_wait=0.005)
+        result = await batcher.submit(question)
+
+    Args:
+        executor -> InferenceExecutor running the batched function.
+        max_batch_size -> Default: 8. Largest number of questions in a batch.
+        max_wait -> Default: 0.005. Seconds a question may wait for others to join its batch.
+    '''
+    def __init__(self, executor, max_batch_size=8, max_wait=0.005):
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        # (question, future) of the batch being built, and the timer sending it.
+        self.batch = []
+        self.timer = None
+
+        # Number of batches answered and number of questions in them. Batches refused by the
+        # executor, e.g. when it is overloaded, are not counted.
+        self.batches = 0
+        self.questions = 0
+
+    def submit(self, question):
+        '''Add a question to the next batch.
+
+        Args:
+            question -> Question to be answered.
+        Returns:
+            Future resolved with the result of the question, or failing with the error of its batch.
+        '''
+        future = Future()
+        self.batch.append((question, future))
+
+        if len(self.batch) >= self.max_batch_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = IOLoop.current().call_later(self.max_wait, self.flush)
+
+        return future
+
+    def flush(self):
+        '''Send the batch being built.'''
+        if self.timer is not None:
+            IOLoop.current().remove_timeout(self.timer)
+            self.timer = None
+
+        batch, self.batch = self.batch, []
+
+        if batch:
+            IOLoop.current().spawn_callback(self.run, batch)
+
+    async def run(self, batch):
+        '''Answer the questions of a batch with a single inference call.
+
+        Args:
+            batch -> List of (question, future) tuples.
+        '''
+        try:
+            results = await self.executor.submit([question for question, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.questions += len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
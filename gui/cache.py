@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+from tornado.concurrent import Future
+
+from poncho.utils.dedup import normalize
+
+
+class ResponseCache(object):
+    '''Cache the results of inference by question. Questions are compared after normalizing their
+    case, punctuation and spacing, so that e.g. "Hi!" and "hi" share their answer. At most
+    'max_size' results are kept, the least recently used being evicted first, and results older
+    than 'ttl' seconds are computed again. Identical questions arriving while the result is being
+    computed wait for that computation instead of starting their own.
+
+    Usage:
+        cache = ResponseCache(max_size=1024)
+        result = await cache.get(question, compute)
+
+    Args:
+        max_size -> Default: 1024. Largest number of results kept.
+        ttl -> Default: None. Seconds a result is kept for. No limit if None.
+    '''
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # Normalized question -> (time stored, result), least recently used first.
+        self.results = OrderedDict()
+        # Normalized question -> Future of the result being computed.
+        self.in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.results)
+
+    async def get(self, question, compute):
+        '''Get the result of a question, computing it if it is not cached.
+
+        Args:
+            question -> Question to be answered.
+            compute -> Coroutine function computing the result of a question.
+        Raises:
+            Any error raised by 'compute'; errors are not cached.
+        Returns:
+            Result of the question.
+        '''
+        key = normalize(question)
+
+        if key in self.results:
+            stored, result = self.results[key]
+
+            if self.ttl is None or time.monotonic() - stored < self.ttl:
+                self.results.move_to_end(key)
+                self.hits += 1
+                return result
+
+            del self.results[key]
+
+        if key in self.in_flight:
+            self.coalesced += 1
+            future = self.in_flight[key]
+
+            try:
+                # Shielded, so that a waiter leaving does not cancel the result for the others.
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The request computing the result was cancelled: compute it again, unless this
+                # request was cancelled itself.
+                if not future.cancelled():
+                    raise
+
+            return await self.get(question, compute)
+
+        self.misses += 1
+
+        future = Future()
+        self.in_flight[key] = future
+        # The result is only stored if the cache was not invalidated while it was being computed.
+        invalidations = self.invalidations
+
+        try:
+            result = await compute(question)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the error as retrieved, since there may be no other request waiting for it.
+            future.exception()
+            raise
+        except BaseException:
+            # Cancelled, e.g. because the client left, since asyncio.CancelledError is not an
+            # Exception. The waiting requests compute the result again.
+            future.cancel()
+            raise
+        finally:
+            del self.in_flight[key]
+
+        future.set_result(result)
+
+        if invalidations == self.invalidations:
+            self.put(key, result)
+
+        return result
+
+    def put(self, key, result):
+        '''Store a result, evicting the least recently used ones if the cache is full.
+
+        Args:
+            key -> Normalized question.
+            result -> Result of the question.
+        '''
+        if self.max_size <= 0:
+            return
+
+        self.results[key] = (time.monotonic(), result)
+        self.results.move_to_end(key)
+
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        '''Drop all the results, e.g. when the model has changed. Results being computed are still
+        returned to their requests but not stored.'''
+        self.results.clear()
+        self.invalidations += 1
+
+
+class CheckpointWatcher(object):
+    '''Invalidate a cache when a file, e.g. the checkpoint index of the model, is modified.
+
+    Args:
+        cache -> ResponseCache to be invalidated.
+        path -> Path to the file. It may not exist yet.
+    '''
+    def __init__(self, cache, path):
+        self.cache = cache
+        self.path = path
+        self.mtime = self.get_mtime()
+
+    def get_mtime(self):
+        '''Get the modification time of the file, or None if it does not exist.'''
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def check(self):
+        '''Invalidate the cache if the file has changed since the last check. Meant to be run
+        periodically, e.g. by a tornado.ioloop.PeriodicCallback.'''
+        mtime = self.get_mtime()
+
+        if mtime != self.mtime:
+            self.mtime = mtime
+            self.cache.invalidate()
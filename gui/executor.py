@@ -0,0 +1,78 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+
+class Overloaded(Exception):
+    '''Raised when a call is rejected because too many calls are already running or waiting.'''
+    pass
+
+
+class InferenceExecutor(object):
+    '''Run a blocking function, e.g. the model inference, on a pool of threads so that the IOLoop
+    keeps serving other requests while it runs.
+
+    At most 'concurrency' calls run at the same time and at most 'queue_size' more wait for a free
+    thread; further calls fail immediately with Overloaded instead of piling up. A call that does
+    not finish within 'timeout' seconds raises tornado.gen.TimeoutError to its caller. It keeps its
+    thread until it actually finishes, so it keeps counting towards the limits.
+
+    Usage:
+        executor = InferenceExecutor(inference)
+        result = await executor.submit(question)
+
+    Args:
+        func -> Blocking function to be called.
+        concurrency -> Default: 1. Number of calls running at the same time.
+        queue_size -> Default: 16. Number of calls that may wait for a free thread.
+        timeout -> Default: 30. Seconds after which a call is abandoned. No timeout if None.
+    '''
+    def __init__(self, func, concurrency=1, queue_size=16, timeout=30):
+        self.func = func
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+
+        # Number of calls running or waiting for a thread.
+        self.pending = 0
+
+    @property
+    def overloaded(self):
+        '''True if new calls would be rejected.'''
+        return self.pending >= self.concurrency + self.queue_size
+
+    def done(self, future):
+        '''Release the slot of a finished call.'''
+        self.pending -= 1
+
+    async def submit(self, *args):
+        '''Call the function with the given arguments on the thread pool.
+
+        Args:
+            args -> Arguments of the function.
+        Raises:
+            Overloaded if the call cannot be queued.
+            tornado.gen.TimeoutError if the call does not finish in time.
+        Returns:
+            Value returned by the function.
+        '''
+        if self.overloaded:
+            raise Overloaded('{} calls are already running or waiting.'.format(self.pending))
+
+        self.pending += 1
+
+        future = IOLoop.current().run_in_executor(self.pool, self.func, *args)
+        future.add_done_callback(self.done)
+
+        if self.timeout is None:
+            return await future
+
+        return await gen.with_timeout(timedelta(seconds=self.timeout), future)
+
+    def shutdown(self):
+        '''Stop the thread pool once the running calls have finished.'''
+        self.pool.shutdown(wait=False)
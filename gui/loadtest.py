@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from urllib.parse import urlsplit, urlencode
+
+
+# Questions sent when no file of questions is given.
+QUESTIONS = [
+    'hi',
+    'how are you?',
+    'what is your name?',
+    'what do you think about cats?',
+    'tell me a joke',
+    'do you like reddit?',
+    'what is the meaning of life?',
+    'where are you from?',
+    'can you help me with my homework?',
+    'what is your favourite movie?',
+]
+
+
+class Connection(object):
+    '''HTTP/1.1 connection to the server, kept alive between requests.
+
+    Args:
+        host -> Host of the server.
+        port -> Port of the server.
+    '''
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def post(self, path, body):
+        '''Send a form encoded POST request and read its response.
+
+        Args:
+            path -> Path of the request.
+            body -> Form encoded body.
+        Raises:
+            OSError or asyncio.IncompleteReadError if the connection fails.
+        Returns:
+            Status code of the response.
+            Body of the response.
+        '''
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+        body = body.encode('utf-8')
+        self.writer.write(
+            'POST {} HTTP/1.1\r\nHost: {}:{}\r\nContent-Type: application/x-www-form-urlencoded\r\n'
+            'Content-Length: {}\r\n\r\n'.format(path, self.host, self.port, len(body)).encode('ascii') + body
+        )
+
+        try:
+            status_line = await self.reader.readuntil(b'\r\n')
+            status = int(status_line.split()[1])
+
+            length = None
+            keep_alive = True
+            while True:
+                line = await self.reader.readuntil(b'\r\n')
+                if line == b'\r\n':
+                    break
+
+                name, _, value = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                if name == 'content-length':
+                    length = int(value)
+                elif name == 'connection' and value.strip().lower() == 'close':
+                    keep_alive = False
+
+            if length is None:
+                response = await self.reader.read()
+                keep_alive = False
+            else:
+                response = await self.reader.readexactly(length)
+        except Exception:
+            self.close()
+            raise
+
+        if not keep_alive:
+            self.close()
+
+        return status, response
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = self.writer = None
+
+
+class Stats(object):
+    '''Latencies and outcomes of the requests of a load test.'''
+    def __init__(self):
+        # Latencies of the successful requests, in seconds.
+        self.latencies = []
+        # Number of requests by outcome: the status code, or 'error' if the connection failed.
+        self.outcomes = Counter()
+        self.start = time.perf_counter()
+        self.end = None
+
+    def record(self, outcome, latency):
+        self.outcomes[outcome] += 1
+
+        if outcome == 200:
+            self.latencies.append(latency)
+
+    def percentile(self, p):
+        '''Get a percentile of the latencies of the successful requests, in seconds.'''
+        if not self.latencies:
+            return None
+
+        latencies = sorted(self.latencies)
+        return latencies[min(int(p / 100 * len(latencies)), len(latencies) - 1)]
+
+    def report(self):
+        '''Summarize the load test.
+
+        Returns:
+            Dictionary of the throughput, the error rate, the latency percentiles and the outcomes.
+        '''
+        duration = (self.end or time.perf_counter()) - self.start
+        total = sum(self.outcomes.values())
+        succeeded = self.outcomes[200]
+
+        def ms(seconds):
+            return None if seconds is None else round(seconds * 1000, 2)
+
+        return {
+            'duration': round(duration, 3),
+            'requests': total,
+            'throughput': round(succeeded / duration, 2) if duration > 0 else None,
+            'error_rate': round(1 - succeeded / total, 4) if total else None,
+            'p50_ms': ms(self.percentile(50)),
+            'p95_ms': ms(self.percentile(95)),
+            'p99_ms': ms(self.percentile(99)),
+            'max_ms': ms(max(self.latencies) if self.latencies else None),
+            'mean_ms': ms(sum(self.latencies) / len(self.latencies) if self.latencies else None),
+            'outcomes': {str(outcome): count for outcome, count in sorted(self.outcomes.items(), key=str)},
+        }
+
+
+class LoadTest(object):
+    '''Send chat messages to the /msg endpoint of the server.
+
+    In a closed loop, a fixed number of users each send a message as soon as they got the answer to
+    their previous one, so the load adapts to the speed of the server. In an open loop, messages
+    are sent at random times at a fixed average rate whatever the speed of the server, like many
+    independent users would. Their latency is measured from the time they were due, so messages
+    delayed because all the connections were busy count as slow.
+
+    Args:
+        url -> URL of the server, e.g. 'http://localhost:8888'.
+        questions -> Questions sent, picked at random.
+        seed -> Default: None. Seed of the random generator.
+    '''
+    def __init__(self, url, questions, seed=None):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 80
+        self.path = (parts.path.rstrip('/') or '') + '/msg'
+
+        self.questions = questions
+        self.rng = random.Random(seed)
+        self.stats = Stats()
+
+    async def send(self, connection, due):
+        '''Send a message and record its outcome.
+
+        Args:
+            connection -> Connection the message is sent on.
+            due -> Time the message was due, from time.perf_counter.
+        '''
+        body = urlencode({'data': self.rng.choice(self.questions)})
+
+        try:
+            status, _ = await connection.post(self.path, body)
+        except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+            status = 'error'
+
+        self.stats.record(status, time.perf_counter() - due)
+
+    async def closed_loop(self, users, duration=None, requests=None, think_time=0.0):
+        '''Run a closed loop load test.
+
+        Args:
+            users -> Number of users, each with its own connection.
+            duration -> Default: None. Seconds the test lasts.
+            requests -> Default: None. Number of messages sent in total.
+            think_time -> Default: 0. Seconds a user waits after an answer before the next message.
+        Returns:
+            Stats of the test.
+        '''
+        self.stats.start = time.perf_counter()
+        end = None if duration is None else self.stats.start + duration
+        remaining = [requests]
+
+        async def user():
+            connection = Connection(self.host, self.port)
+
+            try:
+                while end is None or time.perf_counter() < end:
+                    if remaining[0] is not None:
+                        if remaining[0] <= 0:
+                            break
+                        remaining[0] -= 1
+
+                    await self.send(connection, time.perf_counter())
+
+                    if think_time:
+                        await asyncio.sleep(think_time)
+            finally:
+                connection.close()
+
+        await asyncio.gather(*[user() for _ in range(users)])
+        self.stats.end = time.perf_counter()
+
+        return self.stats
+
+    async def open_loop(self, rate, connections, duration=None, requests=None):
+        '''Run an open loop load test.
+
+        Args:
+            rate -> Average number of messages sent per second.
+            connections -> Largest number of connections open at the same time.
+            duration -> Default: None. Seconds during which messages are sent.
+            requests -> Default: None. Number of messages sent in total.
+        Returns:
+            Stats of the test.
+        '''
+        pool = asyncio.Queue()
+        for _ in range(connections):
+            pool.put_nowait(Connection(self.host, self.port))
+
+        async def message(due):
+            connection = await pool.get()
+
+            try:
+                await self.send(connection, due)
+            finally:
+                pool.put_nowait(connection)
+
+        tasks = []
+        start = self.stats.start = time.perf_counter()
+        due = start
+
+        while (duration is None or due - start < duration) and (requests is None or len(tasks) < requests):
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            tasks.append(asyncio.ensure_future(message(due)))
+
+            # Poisson arrivals.
+            due += self.rng.expovariate(rate)
+
+        await asyncio.gather(*tasks)
+        self.stats.end = time.perf_counter()
+
+        while not pool.empty():
+            pool.get_nowait().close()
+
+        return self.stats
+
+
+def read_questions(path):
+    '''Read the questions of a file, one per line, skipping empty lines.'''
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def print_report(report):
+    print('Requests: {}. Duration: {} s. Throughput: {} answers/s. Error rate: {:.2%}.'.format(
+        report['requests'], report['duration'], report['throughput'], report['error_rate'] or 0
+    ))
+    print('Latency (ms): p50 {} | p95 {} | p99 {} | max {} | mean {}'.format(
+        report['p50_ms'], report['p95_ms'], report['p99_ms'], report['max_ms'], report['mean_ms']
+    ))
+    print('Outcomes: {}'.format(', '.join('{}: {}'.format(outcome, count) for outcome, count in report['outcomes'].items())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Load test the /msg endpoint of the chat server.')
+
+    parser.add_argument('--url', default='http://localhost:8888', help='URL of the server. Default: http://localhost:8888.')
+    parser.add_argument('--mode', choices=('closed', 'open'), default='closed', help='Closed loop with a fixed number of users, or open loop with a fixed rate. Default: closed.')
+    parser.add_argument('-c', '--users', type=int, default=10, help='Number of users of the closed loop. Default: 10.')
+    parser.add_argument('--think', type=float, default=0.0, help='Seconds a user of the closed loop waits between an answer and its next message. Default: 0.')
+    parser.add_argument('-r', '--rate', type=float, default=10.0, help='Messages per second of the open loop. Default: 10.')
+    parser.add_argument('--connections', type=int, default=100, help='Largest number of connections of the open loop. Default: 100.')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds the test lasts. Default: 10.')
+    parser.add_argument('-n', '--requests', type=int, default=None, help='Number of messages sent, instead of a duration.')
+    parser.add_argument('--questions', default=None, help='File of questions, one per line. Default: a few built-in questions.')
+    parser.add_argument('--distinct', type=int, default=None, help='Make this many numbered variants of every question, e.g. to control how often the cache is hit.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed of the choice of questions and of the open loop arrivals.')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    args = parser.parse_args()
+
+    questions = read_questions(args.questions) if args.questions else QUESTIONS
+    if args.distinct:
+        questions = ['{} {}'.format(question, i) for i in range(args.distinct) for question in questions]
+
+    duration = None if args.requests is not None else args.duration
+    test = LoadTest(args.url, questions, args.seed)
+
+    if args.mode == 'closed':
+        stats = asyncio.run(test.closed_loop(args.users, duration, args.requests, args.think))
+    else:
+        stats = asyncio.run(test.open_loop(args.rate, args.connections, duration, args.requests))
+
+    report = stats.report()
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
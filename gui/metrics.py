@@ -0,0 +1,208 @@
+import os
+import time
+import bisect
+import threading
+
+from poncho.utils.telemetry import peak_rss
+
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Upper bounds, in words, of the buckets of the length histograms.
+LENGTH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+def format_labels(labels):
+    '''Format labels the way the Prometheus text format expects them, e.g. {status="200"}.'''
+    if not labels:
+        return ''
+
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in labels) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    '''Count events, optionally split by the value of a label. If 'func' is given, the count is
+    read from it on every scrape instead, e.g. from the counters of another component.
+
+    Args:
+        name -> Name of the metric, without the '_total' suffix added to it.
+        help -> Description of the metric.
+        label -> Default: None. Name of the label splitting the counts.
+        func -> Default: None. Function returning the current count.
+    '''
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None, func=None):
+        # The text format requires the samples of a counter to have the name of its TYPE line.
+        self.name = name + '_total'
+        self.help = help
+        self.label = label
+        self.func = func
+        # Label value -> count.
+        self.values = {}
+
+    def inc(self, value=None, amount=1):
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def samples(self):
+        if self.func is not None:
+            yield self.name, [], self.func()
+            return
+
+        for value, count in sorted(self.values.items(), key=lambda item: str(item[0])):
+            labels = [(self.label, value)] if self.label is not None else []
+            yield self.name, labels, count
+
+
+class Gauge(object):
+    '''Value that goes up and down. If 'func' is given, the value is read from it on every scrape
+    instead of being kept up to date.
+
+    Args:
+        name -> Name of the metric.
+        help -> Description of the metric.
+        func -> Default: None. Function returning the current value.
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, help, func=None):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def samples(self):
+        yield self.name, [], self.func() if self.func is not None else self.value
+
+
+class Histogram(object):
+    '''Distribution of observed values, counted in cumulative buckets. Observations may come from
+    other threads.
+
+    Args:
+        name -> Name of the metric.
+        help -> Description of the metric.
+        buckets -> Sorted upper bounds of the buckets. A +Inf bucket is always added.
+    '''
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+
+        # Number of observations falling in every bucket, the last one being +Inf. They are only
+        # accumulated when scraped, so that an observation costs a single increment.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            yield self.name + '_bucket', [('le', format_value(float(bound)))], cumulative
+
+        yield self.name + '_sum', [], total
+        yield self.name + '_count', [], cumulative
+
+
+def get_resident_memory():
+    '''Get the resident memory of the process in bytes, or its peak if the current value cannot be
+    read on this platform.'''
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss()
+
+
+class Metrics(object):
+    '''Metrics of the chat server, rendered in the Prometheus text format. Every worker process
+    keeps its own.
+
+    Usage:
+        metrics = Metrics()
+        executor = InferenceExecutor(metrics.timed(inference))
+        text = metrics.render()
+    '''
+    def __init__(self):
+        self.inference_seconds = Histogram(
+            'poncho_inference_seconds',
+            'Time spent running the model, per call. A batched call counts once.'
+        )
+        self.request_seconds = Histogram(
+            'poncho_request_seconds',
+            'Time from receiving a question to having its answer, including the time spent queued.'
+        )
+        self.requests = Counter('poncho_requests', 'Questions answered, by HTTP status.', label='status')
+        self.in_flight = Gauge('poncho_requests_in_flight', 'Questions being answered.')
+        self.input_words = Histogram('poncho_input_words', 'Number of words of the questions.', LENGTH_BUCKETS)
+        self.output_words = Histogram('poncho_output_words', 'Number of words of the answers.', LENGTH_BUCKETS)
+
+        self.metrics = [
+            self.inference_seconds,
+            self.request_seconds,
+            self.requests,
+            self.in_flight,
+            self.input_words,
+            self.output_words,
+            Gauge('process_resident_memory_bytes', 'Resident memory of the process.', get_resident_memory),
+            Gauge('process_max_resident_memory_bytes', 'Peak resident memory of the process.', peak_rss),
+        ]
+
+    def add(self, metric):
+        '''Add a metric to be rendered, e.g. a Gauge reading the state of another component.'''
+        self.metrics.append(metric)
+
+    def timed(self, func):
+        '''Wrap a function so that the duration of its calls is observed by 'inference_seconds'.'''
+        def wrapper(*args):
+            start = time.perf_counter()
+            try:
+                return func(*args)
+            finally:
+                self.inference_seconds.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    def render(self):
+        '''Render all the metrics.
+
+        Returns:
+            Metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, format_labels(labels), format_value(value)))
+
+        return '\n'.join(lines) + '\n'
@@ -1,12 +1,83 @@
 import os
 import sys
+import json
+import time
+import logging
 
 import tornado.ioloop
 import tornado.web
+import tornado.websocket
+from tornado import gen
+from tornado.httpserver import HTTPServer
+from tornado.netutil import bind_sockets
+from tornado.process import fork_processes, task_id
+from tornado.options import define, options, parse_command_line
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
 
-from nmt_chatbot.inference import inference
+from gui.backends import BACKENDS, check_backend, load_backend
+from gui.executor import InferenceExecutor, Overloaded
+from gui.batcher import MicroBatcher
+from gui.cache import ResponseCache, CheckpointWatcher
+from gui.metrics import Metrics, Counter, Gauge
+
+
+define('port', default=8888, help='Port the server listens on.', type=int)
+define('debug', default=True, help='Run the application in debug mode. Only used with a single process.', type=bool)
+define('processes', default=1, help='Number of worker processes sharing the port. 0 starts one per CPU.', type=int)
+define('backend', default='nmt', help='Inference backend: {}. "stub" answers without the model.'.format(', '.join(BACKENDS)), type=str)
+define('stub_latency', default=50.0, help='Milliseconds taken by the stub backend to answer a question.', type=float)
+define('stub_batch_latency', default=10.0, help='Milliseconds added by the stub backend for every further question of a batch.', type=float)
+define('stub_jitter', default=0.0, help='Largest fraction of its latency the stub backend adds to an answer, chosen from the question.', type=float)
+define('warmup', default=True, help='Load the model and answer a few questions before accepting requests.', type=bool)
+define('concurrency', default=1, help='Number of inference calls running at the same time.', type=int)
+define('queue_size', default=16, help='Number of requests that may wait for inference before new ones get a 503.', type=int)
+define('timeout', default=30.0, help='Seconds after which a request waiting for inference gets a 504.', type=float)
+define('batch_size', default=1, help='Largest number of questions answered by a single inference call. 1 disables batching.', type=int)
+define('batch_wait', default=5.0, help='Milliseconds a question may wait for others to join its batch.', type=float)
+define('cache_size', default=1024, help='Number of answers cached by normalized question. 0 disables the cache.', type=int)
+define('cache_ttl', default=0.0, help='Seconds an answer stays cached. 0 keeps answers until they are evicted.', type=float)
+define(
+    'cache_watch',
+    default=os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'nmt_chatbot', 'model', 'checkpoint'),
+    help='File whose modification empties the cache, e.g. the checkpoint index of the model.',
+    type=str
+)
+define('cache_watch_interval', default=10.0, help='Seconds between checks of the watched file.', type=float)
+define('metrics', default=True, help='Expose the metrics of the worker at /metrics.', type=bool)
+
+
+# Questions answered by every worker before it accepts requests.
+WARMUP_QUESTIONS = ['hi', 'how are you?']
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    '''Liveness probe: answers as long as the IOLoop of the worker is responsive.'''
+    def get(self):
+        self.write('ok')
+
+
+class ReadyHandler(tornado.web.RequestHandler):
+    '''Readiness probe: answers 200 while the worker accepts messages, and 503 while it is rejecting
+    them because it is overloaded. Workers only serve requests once the model is warmed up.'''
+    def initialize(self, chatbot):
+        self.chatbot = chatbot
+
+    def get(self):
+        if self.chatbot.executor.overloaded:
+            raise tornado.web.HTTPError(503, reason='Overloaded')
+
+        self.write('ready')
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    '''Metrics of the worker answering the request, in the Prometheus text format.'''
+    def initialize(self, metrics):
+        self.metrics = metrics
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.metrics.render())
 
 
 class MainHandler2(tornado.web.RequestHandler):
@@ -14,23 +85,246 @@ class MainHandler2(tornado.web.RequestHandler):
         self.render('chatbot.html')
 
 
+class Chatbot(object):
+    '''Answer questions with the model, through the cache, the micro-batcher and the executor
+    that are enabled.
+
+    Args:
+        executor -> InferenceExecutor running the model.
+        batcher -> Default: None. MicroBatcher grouping the questions, if batching is enabled.
+        cache -> Default: None. ResponseCache of the answers, if caching is enabled.
+        metrics -> Default: None. Metrics recording the questions and answers, if enabled.
+    '''
+    def __init__(self, executor, batcher=None, cache=None, metrics=None):
+        self.executor = executor
+        self.batcher = batcher
+        self.cache = cache
+        self.metrics = metrics
+
+    async def infer(self, question):
+        # Run the model on the executor so that the IOLoop keeps serving other requests.
+        if self.batcher is not None:
+            return await self.batcher.submit(question)
+        else:
+            return await self.executor.submit(question)
+
+    async def answer(self, question):
+        '''Answer a question.
+
+        Args:
+            question -> Question to be answered.
+        Raises:
+            tornado.web.HTTPError with a 503 status if the server is overloaded, or a 504 status if
+            the answer takes too long.
+        Returns:
+            Answer to the question.
+        '''
+        if self.metrics is None:
+            return await self.get_answer(question)
+
+        metrics = self.metrics
+        metrics.in_flight.inc()
+        metrics.input_words.observe(len(question.split()))
+        start = time.perf_counter()
+        status = 500
+
+        try:
+            answer = await self.get_answer(question)
+            status = 200
+        except tornado.web.HTTPError as e:
+            status = e.status_code
+            raise
+        finally:
+            metrics.request_seconds.observe(time.perf_counter() - start)
+            metrics.requests.inc(status)
+            metrics.in_flight.dec()
+
+        metrics.output_words.observe(len(answer.split()))
+        return answer
+
+    async def get_answer(self, question):
+        try:
+            if self.cache is not None:
+                result = await self.cache.get(question, self.infer)
+            else:
+                result = await self.infer(question)
+        except Overloaded:
+            raise tornado.web.HTTPError(503, reason='Too many requests, try again later')
+        except gen.TimeoutError:
+            raise tornado.web.HTTPError(504, reason='The answer took too long')
+
+        return result['answers'][0]
+
+
 class MainHandler(tornado.web.RequestHandler):
-    def post(self):
-        data = self.request.body
-        # Call your function here and save it into output
-        output = inference(data.decode('utf-8').split('=')[1])['answers'][0]
+    def initialize(self, chatbot):
+        self.chatbot = chatbot
+
+    async def post(self):
+        # Form encoded by the client; a missing message is answered with a 400.
+        question = self.get_body_argument('data')
+
+        output = await self.chatbot.answer(question)
         self.write(output)
 
 
-def make_app():
+class ChatSocketHandler(tornado.websocket.WebSocketHandler):
+    '''Chat over a persistent connection. Every message is a JSON object: the client sends
+    {"id": <id>, "message": <question>} and the server answers with {"id": <id>, "answer": <answer>}
+    or, if the question could not be answered, {"id": <id>, "status": <HTTP status>, "error": <reason>}.
+    Several questions may be pending on a connection at the same time.
+    '''
+    def initialize(self, chatbot):
+        self.chatbot = chatbot
+
+    def on_message(self, message):
+        try:
+            data = json.loads(message)
+            question = data['message']
+            if not isinstance(question, str):
+                raise ValueError('The message must be a string.')
+        except (ValueError, TypeError, KeyError):
+            self.reply({'id': None, 'status': 400, 'error': 'Invalid message'})
+            return
+
+        # Answer in the background so that the next messages are read meanwhile.
+        tornado.ioloop.IOLoop.current().spawn_callback(self.answer, data.get('id'), question)
+
+    async def answer(self, id_, question):
+        try:
+            output = await self.chatbot.answer(question)
+        except tornado.web.HTTPError as e:
+            self.reply({'id': id_, 'status': e.status_code, 'error': e.reason})
+            return
+        except Exception:
+            # Answer like POST /msg does, so that the client does not wait for the question forever.
+            logging.exception('Error answering a chat message')
+            self.reply({'id': id_, 'status': 500, 'error': 'Internal error'})
+            return
+
+        self.reply({'id': id_, 'answer': output})
+
+    def reply(self, data):
+        try:
+            self.write_message(json.dumps(data))
+        except tornado.websocket.WebSocketClosedError:
+            # The client left before its answer was ready.
+            pass
+
+
+def make_app(inference):
+    # The model calls are timed in the threads running them, so that the time spent queued is not
+    # counted as inference time.
+    metrics = Metrics() if options.metrics else None
+
+    executor = InferenceExecutor(
+        metrics.timed(inference) if metrics is not None else inference,
+        concurrency=options.concurrency,
+        queue_size=options.queue_size,
+        timeout=options.timeout
+    )
+
+    # With batching, the executor runs the model on lists of questions.
+    batcher = None
+    if options.batch_size > 1:
+        batcher = MicroBatcher(executor, max_batch_size=options.batch_size, max_wait=options.batch_wait / 1000)
+
+    # Cache of the answers, emptied whenever the model checkpoint changes.
+    cache = None
+    if options.cache_size > 0:
+        cache = ResponseCache(max_size=options.cache_size, ttl=options.cache_ttl or None)
+
+        watcher = CheckpointWatcher(cache, options.cache_watch)
+        tornado.ioloop.PeriodicCallback(watcher.check, options.cache_watch_interval * 1000).start()
+
+    chatbot = Chatbot(executor, batcher=batcher, cache=cache, metrics=metrics)
+
+    handlers = [
+        (r"/msg", MainHandler, dict(chatbot=chatbot)),
+        (r"/ws", ChatSocketHandler, dict(chatbot=chatbot)),
+        (r"/healthz", HealthHandler),
+        (r"/readyz", ReadyHandler, dict(chatbot=chatbot)),
+        (r"/", MainHandler2),
+    ]
+
+    if metrics is not None:
+        # The state of the other components is only read when the metrics are scraped.
+        metrics.add(Gauge('poncho_inference_pending', 'Inference calls running or waiting for a thread.', lambda: executor.pending))
+
+        if batcher is not None:
+            metrics.add(Counter('poncho_batches', 'Batched inference calls answered.', func=lambda: batcher.batches))
+            metrics.add(Counter('poncho_batched_questions', 'Questions answered by batched calls.', func=lambda: batcher.questions))
+
+        if cache is not None:
+            metrics.add(Gauge('poncho_cache_size', 'Answers cached.', lambda: len(cache)))
+            metrics.add(Counter('poncho_cache_hits', 'Questions answered from the cache.', func=lambda: cache.hits))
+            metrics.add(Counter('poncho_cache_misses', 'Questions not found in the cache.', func=lambda: cache.misses))
+            metrics.add(Counter('poncho_cache_coalesced', 'Questions that waited for an identical one.', func=lambda: cache.coalesced))
+            metrics.add(Counter('poncho_cache_evictions', 'Answers dropped from the full cache.', func=lambda: cache.evictions))
+            metrics.add(Counter('poncho_cache_invalidations', 'Times the cache was cleared, e.g. for a new checkpoint.', func=lambda: cache.invalidations))
+
+        handlers.append((r"/metrics", MetricsHandler, dict(metrics=metrics)))
+
     return tornado.web.Application(
-        [(r"/msg", MainHandler), (r"/", MainHandler2)],
+        handlers,
         template_path=os.path.join(os.path.dirname(__file__), "templates"),
-        debug=True
+        # Static files are served with content-hashed URLs from static_url, which are cached by the
+        # browsers for a long time, and with ETags so that other requests can be answered with a 304.
+        static_path=os.path.join(os.path.dirname(__file__), "static"),
+        compress_response=True,
+        # Autoreload cannot be used with multiple processes.
+        debug=options.debug and options.processes == 1,
+        # Keep idle chat connections open through proxies, and refuse oversized messages.
+        websocket_ping_interval=30,
+        websocket_max_message_size=1 << 16
     )
 
 
+def warm_up(inference):
+    '''Load the model and answer some questions with it, in the shapes used by the server, so that
+    the first requests do not wait for the graph to be built.
+
+    Args:
+        inference -> Inference function of the backend.
+    '''
+    for question in WARMUP_QUESTIONS:
+        inference(question)
+
+    if options.batch_size > 1:
+        inference(WARMUP_QUESTIONS[:1] * options.batch_size)
+
+
 if __name__ == "__main__":
-    app = make_app()
-    app.listen(8888)
-    tornado.ioloop.IOLoop.current().start()
\ No newline at end of file
+    parse_command_line()
+
+    # Checked before forking, since fork_processes restarts the workers that fail.
+    try:
+        check_backend(options.backend)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    # The port is bound before forking so that all the workers accept connections from it.
+    sockets = bind_sockets(options.port)
+
+    if options.processes != 1:
+        # Every worker loads its own model; TensorFlow sessions do not survive a fork.
+        fork_processes(options.processes)
+
+    inference = load_backend(
+        options.backend,
+        latency=options.stub_latency / 1000,
+        batch_latency=options.stub_batch_latency / 1000,
+        jitter=options.stub_jitter
+    )
+    app = make_app(inference)
+
+    if options.warmup:
+        logging.info('Worker %s warming up the model', task_id())
+        warm_up(inference)
+
+    # Requests are only accepted once the model is warm; until then they wait in the socket backlog.
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+
+    logging.info('Worker %s ready', task_id())
+    tornado.ioloop.IOLoop.current().start()
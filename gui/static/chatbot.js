@@ -1,26 +1,82 @@
+// Persistent connection to the chat server, or null while it is not open.
+var socket = null;
+// Number of the next message sent over the socket.
+var nextId = 0;
+// Seconds to wait before trying to reconnect; doubled after every failed attempt.
+var reconnectDelay = 1;
+
 function updateScroll() {
     var chatbox = document.getElementById('chatbox');
     chatbox.scrollTop = chatbox.scrollHeight;
 }
 
+function appendMessage(author, text, color) {
+    // The text is inserted as text, never as HTML.
+    var message = $('<div class="text" style="font-size:22px;padding-top:07px"></div>');
+    if (color) {
+        message.css('color', color);
+    }
+    message.append($('<span></span>').append($('<strong></strong>').text(author + ': ')).append(document.createTextNode(text)));
+
+    $('#chatbox').append(message);
+    updateScroll();
+}
+
+function connect() {
+    if (!window.WebSocket) {
+        return;
+    }
+
+    var protocol = window.location.protocol == 'https:' ? 'wss://' : 'ws://';
+    var ws = new WebSocket(protocol + window.location.host + '/ws');
+
+    ws.onopen = function() {
+        socket = ws;
+        reconnectDelay = 1;
+    };
+
+    ws.onmessage = function(event) {
+        var data = JSON.parse(event.data);
+
+        if (data.error) {
+            appendMessage('Poncho', 'Sorry, I could not answer that (' + data.error + ').');
+        } else {
+            appendMessage('Poncho', data.answer);
+        }
+    };
+
+    ws.onclose = function() {
+        // Messages are sent over HTTP until the connection is back.
+        socket = null;
+        setTimeout(connect, reconnectDelay * 1000);
+        reconnectDelay = Math.min(reconnectDelay * 2, 60);
+    };
+}
+
+function send(input) {
+    if (socket !== null && socket.readyState == WebSocket.OPEN) {
+        socket.send(JSON.stringify({id: nextId++, message: input}));
+        return;
+    }
+
+    $.post("/msg", {
+        data: input
+    }).done(function(data) {
+        appendMessage('Poncho', data);
+    }).fail(function(xhr) {
+        appendMessage('Poncho', 'Sorry, I could not answer that (' + (xhr.statusText || 'no connection') + ').');
+    });
+}
+
 function chat() {
-    setInterval(updateScroll, 1);
-    
     if ($('#usermsg').val() != "") {
-        
+
         var input = $('#usermsg').val();
-        //console.log(input);
-        //console.log(5)
-        
-        $('#chatbox').append('<div id="text" style="font-size:22px;padding-top:07px;color:black"><span><strong>You: </strong>' + input + '</span></div>');
+
+        appendMessage('You', input, 'black');
         $('#usermsg').val("");
-        
-        $.post("/msg", {
-            data: input
-        }, function(data) {
-            //console.log(data);
-            $('#chatbox').append('<div id="text" style="font-size:22px;padding-top:07px"><span><strong>Poncho: </strong>' + data + '</span><div>');
-        });
+
+        send(input);
     }
 }
 
@@ -28,8 +84,10 @@ function chatOnEnter(event) {
     if (event.keyCode == 13) {
         chat();
     }
-}	
+}
 
 $(document).ready(function(){
-    
-});
\ No newline at end of file
+    $('#submitmsg').click(chat);
+
+    connect();
+});
@@ -1,10 +1,18 @@
 import argparse
 import re
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 
 from poncho.preprocess.dirty_populate import main as dirty_main
 from poncho.preprocess.cleanup import main as cleanup_main
-from poncho.preprocess.convert_to_csv import main as prepare_main
+from poncho.preprocess.convert_to_csv import main as prepare_main, FORMATS
 from poncho.postprocess.prepare_data import main as train_data_main
+from poncho.preprocess.fused_pipeline import main as fused_main
+from poncho.utils.sqlite_profile import PROFILES
+from poncho.utils.open_log import set_log_tag, open_log
+from poncho.utils.telemetry import profiled
 
 
 # Available actions
@@ -13,8 +21,12 @@ ACTIONS = [
     'cleanupdb',
     'preparedata',
     'createtraindata',
+    'fusedtraindata',
 ]
 
+# Stages run per year, which only touch the databases and files of their year.
+YEAR_ACTIONS = ACTIONS[:3]
+
 def get_unique_years(timeframes):
     '''Get unique years from the 'timeframes' list.
 
@@ -43,10 +55,134 @@ def regexp_check(timeframes):
     '''
     pattern = r'^20[0-9]{2}\-(?:0[1-9]{1}|1[012]{1})$'
     regexp = re.compile(pattern)
-    for timeframe in args.timeframe:
+    for timeframe in timeframes:
         if not regexp.match(timeframe):
             parser.error('{} is not a valid timeframe.'.format(timeframe))
 
+
+def get_actions(args):
+    '''Get the actions to be performed, in order, from the action and the options provided.
+
+    Args:
+        args -> Parsed arguments.
+    Returns:
+        List of actions.
+    '''
+    actions = [args.action]
+
+    # Every option only chains its action if the action before it was performed as well.
+    for option, action in (('autoclean', 'cleanupdb'), ('prepare', 'preparedata'), ('createdata', 'createtraindata')):
+        if ACTIONS.index(action) <= ACTIONS.index(args.action):
+            continue
+        if not getattr(args, option):
+            break
+        actions.append(action)
+
+    return actions
+
+
+def group_by_year(timeframes):
+    '''Group the timeframes by year, keeping the order in which the years were provided.
+
+    Args:
+        timeframes -> Timeframes provided.
+    Returns:
+        Ordered dictionary of the timeframes of every year.
+    '''
+    years = OrderedDict()
+
+    for timeframe in timeframes:
+        years.setdefault(timeframe.split('-')[0], []).append(timeframe)
+
+    return years
+
+
+def run_action(action, timeframes, args):
+    '''Perform an action for the provided timeframes, profiling it if asked to.
+
+    Args:
+        action -> One of ACTIONS.
+        timeframes -> Timeframes provided.
+        args -> Parsed arguments.
+    '''
+    if args.profile:
+        with profiled(action):
+            perform_action(action, timeframes, args)
+    else:
+        perform_action(action, timeframes, args)
+
+
+def perform_action(action, timeframes, args):
+    '''Perform an action for the provided timeframes.
+
+    Args:
+        action -> One of ACTIONS.
+        timeframes -> Timeframes provided.
+        args -> Parsed arguments.
+    '''
+    if action == 'createdirtydb':
+        dirty_main(timeframes, workers=args.workers, batch_size=args.batchsize, profile=args.dbprofile, resume=args.resume)
+    elif action == 'cleanupdb':
+        cleanup_main(get_unique_years(timeframes), batch_size=args.batchsize, profile=args.dbprofile, top_k=args.topk, attach=args.attach)
+    elif action == 'preparedata':
+        prepare_main(get_unique_years(timeframes), profile=args.dbprofile, memory_budget=args.memory << 20, seed=args.seed, fmt=args.format, dedup=args.dedup, max_repeats=args.maxrepeats, near_threshold=args.neardup)
+    elif action == 'fusedtraindata':
+        fused_main(timeframes, workers=args.workers, memory_budget=args.memory << 20, seed=args.seed, dev_fraction=args.dev, test_fraction=args.test, dedup=args.dedup, max_repeats=args.maxrepeats, near_threshold=args.neardup)
+    elif action == 'createtraindata':
+        train_data_main(sorted(get_unique_years(timeframes)), dev_fraction=args.dev, test_fraction=args.test, seed=args.seed, fmt=args.format)
+
+
+def run_year(year, timeframes, actions, args):
+    '''Perform the per year actions for the timeframes of a single year. Run as a job by
+    run_jobs; the logs of the actions and the output of the job are written to log files tagged
+    with the year.
+
+    Args:
+        year -> Year of the timeframes.
+        timeframes -> Timeframes of the year.
+        actions -> Actions to be performed, in order.
+        args -> Parsed arguments.
+    '''
+    set_log_tag(year)
+
+    with open_log('job') as log, redirect_stdout(log):
+        for action in actions:
+            run_action(action, timeframes, args)
+
+    return year
+
+
+def run_jobs(timeframes, actions, args):
+    '''Perform the per year actions with one job per year, running at most 'args.jobs' jobs at
+    the same time. Every year has its own databases, so no two jobs ever write to the same file.
+
+    Args:
+        timeframes -> Timeframes provided.
+        actions -> Actions to be performed, in order.
+        args -> Parsed arguments.
+    Returns:
+        List of the years whose job failed.
+    '''
+    failed = list()
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = OrderedDict()
+        for year, year_timeframes in group_by_year(timeframes).items():
+            futures[year] = executor.submit(run_year, year, year_timeframes, actions, args)
+            print('Started the job of {}.'.format(year))
+
+        for year, future in futures.items():
+            try:
+                future.result()
+                print('Finished the job of {}.'.format(year))
+            except BaseException as e:
+                # SystemExit raised by the actions (e.g. a missing dump) is reported here as well.
+                print('The job of {} failed: {!r}'.format(year, e))
+                failed.append(year)
+
+    return failed
+
+
 # Initalise parser
 parser = argparse.ArgumentParser(description='CLI to interact with poncho the chatbot')
 
@@ -75,73 +211,160 @@ parser.add_argument(
     action='store_true',
     help='Autoexecute "createtraindata" command after "preparedata" for the provided timeframes.'
 )
+# Add workers option
+parser.add_argument(
+    '-w',
+    '--workers',
+    type=int,
+    default=1,
+    help='Number of processes parsing the dumps in "createdirtydb" and "fusedtraindata". Default: 1.'
+)
+# Add jobs option
+parser.add_argument(
+    '-j',
+    '--jobs',
+    type=int,
+    default=1,
+    help='Number of years processed at the same time, each by its own job with its own logs. Default: 1.'
+)
+# Add resume option
+parser.add_argument(
+    '--resume',
+    action='store_true',
+    help='Make "createdirtydb" continue the timeframes from their last checkpoint and skip the ones already ingested.'
+)
+# Add batch size option
+parser.add_argument(
+    '-b',
+    '--batchsize',
+    type=int,
+    default=1000,
+    help='Number of rows inserted into the databases per transaction. Default: 1000.'
+)
+# Add top replies option
+parser.add_argument(
+    '-k',
+    '--topk',
+    type=int,
+    default=1,
+    help='Number of best replies kept for every comment by "cleanupdb". Default: 1.'
+)
+# Add attach option
+parser.add_argument(
+    '--attach',
+    action='store_true',
+    help='Make "cleanupdb" attach the dirty database and copy the data inside SQLite instead of through Python.'
+)
+# Add memory option
+parser.add_argument(
+    '-m',
+    '--memory',
+    type=int,
+    default=1024,
+    help='Memory in MB available to "preparedata" and "fusedtraindata" for the pairs of a year; larger years are spilled to temporary files. Default: 1024.'
+)
+# Add seed option
+parser.add_argument(
+    '--seed',
+    type=int,
+    default=None,
+    help='Seed of the random shuffles and dataset splits, for reproducible datasets.'
+)
+# Add development dataset option
+parser.add_argument(
+    '--dev',
+    type=float,
+    default=0.0,
+    help='Fraction of the pairs written to the tst2012 development dataset by "createtraindata" and "fusedtraindata". Default: 0.'
+)
+# Add test dataset option
+parser.add_argument(
+    '--test',
+    type=float,
+    default=0.0,
+    help='Fraction of the pairs written to the tst2013 test dataset by "createtraindata" and "fusedtraindata". Default: 0.'
+)
+# Add format option
+parser.add_argument(
+    '--format',
+    choices=sorted(FORMATS),
+    default='csv',
+    help='Format of the files written by "preparedata" and read by "createtraindata". "pairs" is a compressed columnar format. Default: csv.'
+)
+# Add deduplication options
+parser.add_argument(
+    '--dedup',
+    action='store_true',
+    help='Make "preparedata" and "fusedtraindata" keep a single copy of pairs that are identical after normalizing case, punctuation and spacing.'
+)
+parser.add_argument(
+    '--maxrepeats',
+    type=int,
+    default=None,
+    help='Number of times the same comment or the same reply may appear in the pairs of a year kept by "preparedata" and "fusedtraindata".'
+)
+parser.add_argument(
+    '--neardup',
+    type=float,
+    default=None,
+    help='Also drop pairs whose estimated similarity with a kept pair is at least this value, between 0 and 1, in "preparedata" and "fusedtraindata".'
+)
+# Add database profile option
+parser.add_argument(
+    '--dbprofile',
+    choices=PROFILES,
+    default='safe',
+    help='SQLite settings used while writing the databases. "bulk" is faster but a crash while writing may corrupt the database. Default: safe.'
+)
+# Add profile option
+parser.add_argument(
+    '--profile',
+    action='store_true',
+    help='Profile every action with cProfile and save the statistics to data/logs. The parse workers started by -w are not profiled.'
+)
 
-# Parse the entered arguments
-args = parser.parse_args()
+if __name__ == '__main__':
+    # Parse the entered arguments
+    args = parser.parse_args()
 
-if args.action == 'createdirtydb':
-    if not args.timeframe:
-        parser.error('-t is required when using "createdirtydb".')
-    else:
-        # Check the formatting of the timeframes provided
-        regexp_check(args.timeframes)
-
-        # Call the function to create the dirty database
-        dirty_main(args.timeframe)
-
-        # Check if "autoclean" option is set
-        if args.autoclean:
-            # Call the function to create the clean database with the unique years
-            cleanup_main(get_unique_years(args.timeframe))
-
-            # Check if "prepare" option is set
-            if args.prepare:
-                # Call function to prepare the data with the unique years
-                prepare_main(get_unique_years(args.timeframe))
-
-                # Check if "createdata" option is set
-                if args.createdata:
-                    # Call the function to create the training dataset with unique years
-                    train_data_main(get_unique_years(args.timeframe))
-elif args.action == 'cleanupdb':
-    if not args.timeframe:
-        parser.error('-t is required when using "cleanupdb"')
-    else:
-        # Check the formatting of the timeframes provided
-        regexp_check(args.timeframe)
-
-        # Call the required function with the unique years
-        cleanup_main(get_unique_years(args.timeframe))
-
-        # Check if "prepare" option is set
-        if args.prepare:
-            # Call function to prepare data with the unique years
-            prepare_main(get_unique_years(args.timeframe))
-
-            # Check if "createdata" option is set
-            if args.createdata:
-                # Call the function to create the training dataset with unique years
-                train_data_main(get_unique_years(args.timeframe))
-elif args.action == 'preparedata':
     if not args.timeframe:
-        parser.error('-t is required when using "preparedata"')
-    else:
-        # Check the formatting of the timeframes provided
-        regexp_check(args.timeframe)
+        parser.error('-t is required when using "{}".'.format(args.action))
+    if args.workers < 1:
+        parser.error('-w must be at least 1.')
+    if args.jobs < 1:
+        parser.error('-j must be at least 1.')
+    if args.batchsize < 1:
+        parser.error('-b must be at least 1.')
+    if args.topk < 1:
+        parser.error('-k must be at least 1.')
+    if args.memory < 1:
+        parser.error('-m must be at least 1.')
+    if args.maxrepeats is not None and args.maxrepeats < 1:
+        parser.error('--maxrepeats must be at least 1.')
+    if args.neardup is not None and not 0 < args.neardup <= 1:
+        parser.error('--neardup must be between 0 and 1.')
+    if args.dev < 0 or args.test < 0 or args.dev + args.test >= 1:
+        parser.error('--dev and --test must not be negative and must add up to less than 1.')
 
-        # Call the function with the unique years
-        prepare_main(get_unique_years(args.timeframe))
+    # Check the formatting of the timeframes provided
+    regexp_check(args.timeframe)
 
-        # Check if "createdata" option is set
-        if args.createdata:
-            # Call the function to create the training dataset with unique years
-            train_data_main(get_unique_years(args.timeframe))
-elif args.action == 'createtraindata':
-    if not args.timeframe:
-        parser.error('-t is required when using "createtraindata"')
+    actions = get_actions(args)
+
+    if args.jobs == 1:
+        for action in actions:
+            run_action(action, args.timeframe, args)
     else:
-        # Check formatting of the timeframes provided
-        regexp_check(args.timeframe)
+        year_actions = [action for action in actions if action in YEAR_ACTIONS]
+
+        if year_actions:
+            failed = run_jobs(args.timeframe, year_actions, args)
+
+            if failed:
+                print('Error: the jobs of {} failed. See their logs in data/logs.'.format(', '.join(failed)))
+                sys.exit(1)
 
-        # Call the function with the unique years
-        train_data_main(get_unique_years(args.timeframe))
+        # The training dataset is built from all the years at once, after the jobs have finished.
+        for action in actions:
+            if action not in YEAR_ACTIONS:
+                run_action(action, args.timeframe, args)
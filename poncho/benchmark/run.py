@@ -0,0 +1,344 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from poncho.utils.get_base_dir import BASE_DIR_VARIABLE
+from poncho.benchmark.synthetic_dump import COMPRESSIONS, write_dump
+
+
+# Root of the repository, where manage.py is.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Stages benchmarked, in the order they depend on each other.
+STAGES = [
+    'createdirtydb',
+    'cleanupdb',
+    'preparedata',
+    'createtraindata',
+    'fusedtraindata',
+]
+
+# Files written by every stage, relative to the work directory.
+OUTPUTS = {
+    'createdirtydb': ['poncho/data/processed/RC_dirty_*.db'],
+    'cleanupdb': ['poncho/data/processed/RC_clean_*.db'],
+    'preparedata': ['poncho/data/prepared/prepared_*'],
+    'createtraindata': ['nmt_chatbot/new_data/*.from', 'nmt_chatbot/new_data/*.to'],
+    'fusedtraindata': ['nmt_chatbot/new_data/*.from', 'nmt_chatbot/new_data/*.to'],
+}
+
+# Directories emptied before every repetition, so that every stage starts from the same state.
+RESET_DIRS = ['poncho/data/processed', 'poncho/data/prepared', 'poncho/data/logs', 'nmt_chatbot/new_data']
+
+# Description of the dumps stored next to them, to reuse them when they are generated again with
+# the same settings.
+DUMPS_FILE = 'synthetic.json'
+
+
+def get_version():
+    '''Get the commit the code being benchmarked was checked out from, if known.'''
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def prepare_dumps(work_dir, timeframes, rows, seed, compression):
+    '''Write the synthetic dumps to the raw directory of the work directory, unless dumps with the
+    same settings are already there.
+
+    Args:
+        work_dir -> Work directory of the benchmark.
+        timeframes -> Timeframes of the dumps.
+        rows -> Number of comments per dump.
+        seed -> Seed of the random generator.
+        compression -> One of COMPRESSIONS.
+    Returns:
+        Total size of the decompressed dumps in bytes.
+    '''
+    raw_dir = os.path.join(work_dir, 'poncho', 'data', 'raw')
+    settings = {'timeframes': timeframes, 'rows': rows, 'seed': seed, 'compression': compression}
+
+    try:
+        with open(os.path.join(raw_dir, DUMPS_FILE)) as f:
+            existing = json.load(f)
+
+        if existing['settings'] == settings:
+            return existing['size']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    shutil.rmtree(raw_dir, ignore_errors=True)
+    os.makedirs(raw_dir)
+
+    size = 0
+    for timeframe in timeframes:
+        print('Writing the dump of {}. Time: {}'.format(timeframe, str(datetime.now())))
+        size += write_dump(raw_dir, timeframe, rows, seed, compression)
+
+    with open(os.path.join(raw_dir, DUMPS_FILE), mode='w') as f:
+        json.dump({'settings': settings, 'size': size}, f)
+
+    return size
+
+
+def telemetry_files(work_dir):
+    '''Get the telemetry files of the work directory. Jobs started with -j write their own.'''
+    return glob.glob(os.path.join(work_dir, 'poncho', 'data', 'logs', 'telemetry*.jsonl'))
+
+
+def read_telemetry(work_dir, stage, timeframes, skip):
+    '''Sum the rows read and accepted by a stage from the telemetry records it wrote.
+
+    Args:
+        work_dir -> Work directory of the benchmark.
+        stage -> Stage run.
+        timeframes -> Timeframes the stage was run on.
+        skip -> Number of records of every telemetry file written before the stage started, as
+                returned by count_records.
+    Returns:
+        Number of rows read.
+        Number of rows accepted.
+    '''
+    records = []
+
+    for path in telemetry_files(work_dir):
+        with open(path, encoding='utf-8') as f:
+            records.extend(json.loads(line) for line in f.readlines()[skip.get(path, 0):])
+
+    records = [record for record in records if record['stage'] == stage and record['event'] == 'end']
+
+    # Stages reading the dumps record every timeframe, and may also record the years they write.
+    by_timeframe = [record for record in records if record['timeframe'] in timeframes]
+    if by_timeframe:
+        records = by_timeframe
+
+    return sum(record['rows_read'] for record in records), sum(record['rows_accepted'] for record in records)
+
+
+def count_records(work_dir):
+    '''Count the records of every telemetry file of the work directory.
+
+    Returns:
+        Dictionary of the number of records by path.
+    '''
+    counts = {}
+
+    for path in telemetry_files(work_dir):
+        with open(path, encoding='utf-8') as f:
+            counts[path] = sum(1 for _ in f)
+
+    return counts
+
+
+def output_size(work_dir, stage):
+    '''Get the total size of the files written by a stage.'''
+    paths = set()
+    for pattern in OUTPUTS[stage]:
+        paths.update(glob.glob(os.path.join(work_dir, pattern)))
+
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def run_stage(work_dir, stage, timeframes, manage_args):
+    '''Run a stage with manage.py in a child process and measure it.
+
+    Args:
+        work_dir -> Work directory of the benchmark, whose 'poncho' directory is used as the base
+                    directory of the pipeline.
+        stage -> One of STAGES.
+        timeframes -> Timeframes the stage is run on.
+        manage_args -> Further arguments of manage.py.
+    Returns:
+        Dictionary of the measures of the stage.
+    '''
+    env = dict(os.environ)
+    env[BASE_DIR_VARIABLE] = os.path.join(work_dir, 'poncho')
+
+    command = [sys.executable, os.path.join(ROOT_DIR, 'manage.py'), stage, '-t'] + timeframes + manage_args
+    skip = count_records(work_dir)
+
+    log_path = os.path.join(work_dir, 'benchmark_{}.txt'.format(stage))
+    with open(log_path, mode='w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+        # wait4 gives the resources used by the child, including the peak memory of the largest of
+        # its processes, e.g. the main process or one of its parse workers.
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+
+    # The process has been waited for already.
+    process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+
+    rows, accepted = read_telemetry(work_dir, stage, timeframes, skip)
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    peak_rss = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+    return {
+        'stage': stage,
+        'returncode': process.returncode,
+        'wall': round(wall, 3),
+        'cpu': round(usage.ru_utime + usage.ru_stime, 3),
+        'rows': rows,
+        'rows_accepted': accepted,
+        'rows_per_sec': round(rows / wall, 1) if wall > 0 else None,
+        'peak_rss': peak_rss,
+        'output_bytes': output_size(work_dir, stage),
+        'log': log_path,
+    }
+
+
+def reset(work_dir):
+    '''Remove everything written by the stages, keeping the dumps.'''
+    for directory in RESET_DIRS:
+        shutil.rmtree(os.path.join(work_dir, directory), ignore_errors=True)
+
+
+def run_benchmark(work_dir, timeframes, stages, manage_args, repeat=1):
+    '''Run the stages on the dumps of the work directory, keeping the fastest of several runs.
+
+    Args:
+        work_dir -> Work directory of the benchmark.
+        timeframes -> Timeframes the stages are run on.
+        stages -> Stages to be run, in order.
+        manage_args -> Further arguments of manage.py.
+        repeat -> Default: 1. Number of times the stages are run.
+    Returns:
+        List of the measures of the fastest run of every stage.
+    '''
+    best = {}
+
+    for run in range(repeat):
+        reset(work_dir)
+
+        for stage in stages:
+            print('Run {} of {}: {}. Time: {}'.format(run + 1, repeat, stage, str(datetime.now())))
+            result = run_stage(work_dir, stage, timeframes, manage_args)
+
+            if result['returncode'] != 0:
+                print('Error: {} failed with code {}. See {}.'.format(stage, result['returncode'], result['log']))
+                return list(best.values()) + [result]
+
+            if stage not in best or result['wall'] < best[stage]['wall']:
+                best[stage] = result
+
+    return [best[stage] for stage in stages]
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
+        size /= 1024
+
+
+def print_results(results, baseline=None):
+    '''Print the measures of the stages as a table, with the ratio of their throughput and peak
+    memory to a baseline if given.
+
+    Args:
+        results -> List of the measures of the stages.
+        baseline -> Default: None. List of the measures of a previous benchmark.
+    '''
+    baseline = {result['stage']: result for result in baseline or []}
+
+    header = '{:<16} {:>9} {:>9} {:>10} {:>12} {:>10} {:>10}'.format(
+        'stage', 'wall (s)', 'cpu (s)', 'rows', 'rows/s', 'peak rss', 'output'
+    )
+    if baseline:
+        header += ' {:>9} {:>9}'.format('speedup', 'memory')
+    print(header)
+
+    for result in results:
+        line = '{:<16} {:>9.2f} {:>9.2f} {:>10} {:>12} {:>10} {:>10}'.format(
+            result['stage'],
+            result['wall'],
+            result['cpu'],
+            result['rows'],
+            result['rows_per_sec'],
+            format_size(result['peak_rss']),
+            format_size(result['output_bytes']),
+        )
+
+        old = baseline.get(result['stage'])
+        if old is not None:
+            line += ' {:>8.2f}x {:>8.2f}x'.format(old['wall'] / result['wall'], result['peak_rss'] / old['peak_rss'])
+
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the stages of manage.py on synthetic Reddit comments dumps.'
+    )
+
+    parser.add_argument('-t', '--timeframe', nargs='+', default=['2015-01', '2015-02'], help='Timeframes of the dumps. Default: 2015-01 2015-02.')
+    parser.add_argument('-n', '--rows', type=int, default=100000, help='Number of comments per dump. Default: 100000.')
+    parser.add_argument('-s', '--stages', nargs='+', choices=STAGES, default=STAGES, help='Stages run, in order. Default: all of them.')
+    parser.add_argument('-r', '--repeat', type=int, default=1, help='Number of runs; the fastest run of every stage is reported. Default: 1.')
+    parser.add_argument('-d', '--directory', default=None, help='Work directory, kept after the benchmark so its dumps are reused. Default: a temporary directory.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated dumps. Default: 0.')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none', help='Compression of the dumps. Default: none.')
+    parser.add_argument('--args', default='', help='Further arguments of manage.py, e.g. "-w 4 --dbprofile bulk".')
+    parser.add_argument('-o', '--output', default=None, help='JSON file the results are written to.')
+    parser.add_argument('--compare', default=None, help='JSON file written by an earlier benchmark to compare the results with.')
+
+    args = parser.parse_args()
+
+    if args.rows < 1:
+        parser.error('-n must be at least 1.')
+    if args.repeat < 1:
+        parser.error('-r must be at least 1.')
+
+    work_dir = args.directory or tempfile.mkdtemp(prefix='poncho_benchmark_')
+
+    size = prepare_dumps(work_dir, args.timeframe, args.rows, args.seed, args.compression)
+    results = run_benchmark(work_dir, args.timeframe, args.stages, shlex.split(args.args), args.repeat)
+    failed = any(result['returncode'] != 0 for result in results)
+
+    # A temporary work directory is kept if a stage failed, so that its log can be read.
+    if args.directory is None and not failed:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        'version': get_version(),
+        'time': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'timeframes': args.timeframe,
+        'rows': args.rows,
+        'dump_bytes': size,
+        'seed': args.seed,
+        'compression': args.compression,
+        'args': args.args,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+
+    print()
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, mode='w') as f:
+            json.dump(report, f, indent=2)
+
+    if failed:
+        sys.exit(1)
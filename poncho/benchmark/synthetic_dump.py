@@ -0,0 +1,258 @@
+import argparse
+import bz2
+import calendar
+import itertools
+import json
+import lzma
+import os
+import random
+import string
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Compressions the dumps can be written with, as found by poncho.utils.read_dump.find_dump.
+COMPRESSIONS = ('none', 'bz2', 'xz', 'zst')
+
+# Fraction of the comments that are top level comments (parent 't3_') rather than replies ('t1_').
+TOP_LEVEL_RATIO = 0.35
+# Fraction of the replies whose parent is not part of the dump, e.g. replies to older threads.
+ORPHAN_RATIO = 0.15
+# Replies are attached to recent comments, picked in proportion to the number of replies they
+# already have plus one, which gives the heavy tailed number of replies per comment seen on Reddit.
+# Roughly the last REPLY_WINDOW comments and replies received are kept as candidates.
+REPLY_WINDOW = 5000
+
+# Fractions of the bodies that were deleted by their author or removed by a moderator.
+DELETED_RATIO = 0.07
+REMOVED_RATIO = 0.03
+# Parameters of the lognormal distribution of the number of words of a body. About 5% of the
+# bodies have more than 50 words.
+WORDS_MU = 2.3
+WORDS_SIGMA = 1.0
+# Fractions of the bodies containing a line break, a double quote and non ASCII characters.
+NEWLINE_RATIO = 0.08
+QUOTE_RATIO = 0.05
+UNICODE_RATIO = 0.03
+
+# Fraction of the comments with a negative score. The other scores follow a Pareto distribution.
+NEGATIVE_RATIO = 0.08
+SCORE_ALPHA = 1.3
+
+# Sizes of the vocabulary and of the subreddits, both used with a Zipf distribution.
+VOCABULARY_SIZE = 20000
+SUBREDDITS = 500
+
+# Non ASCII words mixed into some bodies.
+UNICODE_WORDS = ('café', 'naïve', 'über', '¯\\_(ツ)_/¯', '😂', 'señor', 'Привет')
+
+
+def zipf_weights(n, exponent=1.0):
+    '''Get the cumulative weights of a Zipf distribution over n items, for random.choices.'''
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, n + 1)))
+
+
+def make_words(rng, n):
+    '''Make a vocabulary of n distinct lower case words with realistic lengths.'''
+    words = set()
+
+    while len(words) < n:
+        length = min(1 + int(rng.expovariate(0.25)), 14)
+        words.add(''.join(rng.choice(string.ascii_lowercase) for _ in range(length)))
+
+    # Shorter words are the most frequent ones.
+    return sorted(words, key=lambda word: (len(word), word))
+
+
+def to_base36(n):
+    '''Format a number in base 36, like the IDs of Reddit.'''
+    digits = string.digits + string.ascii_lowercase
+    text = ''
+
+    while True:
+        n, digit = divmod(n, 36)
+        text = digits[digit] + text
+
+        if n == 0:
+            return text
+
+
+def month_range(timeframe):
+    '''Get the Unix times of the start and the end of the month of a timeframe.'''
+    year, month = (int(part) for part in timeframe.split('-'))
+    start = calendar.timegm((year, month, 1, 0, 0, 0))
+    days = calendar.monthrange(year, month)[1]
+
+    return start, start + days * 86400
+
+
+def first_id(timeframe):
+    '''Get the first comment ID number of a timeframe, so that the IDs of different timeframes do
+    not overlap for up to 100M comments per month.'''
+    year, month = (int(part) for part in timeframe.split('-'))
+
+    return ((year - 2005) * 12 + month) * 100000000
+
+
+def generate_rows(timeframe, rows, seed=None):
+    '''Generate comments of a Reddit dump, in the format of the pushshift dumps of 2015.
+
+    Args:
+        timeframe -> Timeframe of the comments, e.g. '2015-01'.
+        rows -> Number of comments.
+        seed -> Default: None. Seed of the random generator. The same seed gives the same comments.
+    Yields:
+        Dictionaries of the comments, in the order of their creation.
+    '''
+    rng = random.Random('{}-{}'.format(seed, timeframe))
+
+    words = make_words(rng, VOCABULARY_SIZE)
+    word_weights = zipf_weights(len(words))
+    subreddit_ids = range(SUBREDDITS)
+    subreddit_weights = zipf_weights(SUBREDDITS, 1.1)
+
+    start, end = month_range(timeframe)
+    step = (end - start) / max(rows, 1)
+    base = first_id(timeframe)
+
+    # ID of a recent comment for each reply it received plus one, trimmed to the window now and then.
+    targets = []
+
+    for i in range(rows):
+        comment_id = to_base36(base + i)
+
+        r = rng.random()
+        if not targets or r < TOP_LEVEL_RATIO:
+            parent_id = 't3_' + to_base36(rng.randrange(base // 100, base // 100 + rows))
+        elif r < TOP_LEVEL_RATIO + (1 - TOP_LEVEL_RATIO) * ORPHAN_RATIO:
+            parent_id = 't1_' + to_base36(rng.randrange(base - 10 * rows, base))
+        else:
+            parent = rng.choice(targets)
+            targets.append(parent)
+            parent_id = 't1_' + parent
+
+        targets.append(comment_id)
+        if len(targets) > 4 * REPLY_WINDOW:
+            del targets[:-REPLY_WINDOW]
+
+        r = rng.random()
+        if r < DELETED_RATIO:
+            body = '[deleted]'
+        elif r < DELETED_RATIO + REMOVED_RATIO:
+            body = '[removed]'
+        else:
+            count = 1 + int(rng.lognormvariate(WORDS_MU, WORDS_SIGMA))
+            body_words = rng.choices(words, cum_weights=word_weights, k=count)
+
+            if rng.random() < UNICODE_RATIO:
+                body_words[rng.randrange(count)] = rng.choice(UNICODE_WORDS)
+            if rng.random() < QUOTE_RATIO:
+                position = rng.randrange(count)
+                body_words[position] = '"{}"'.format(body_words[position])
+
+            body = ' '.join(body_words)
+
+            if rng.random() < NEWLINE_RATIO:
+                body = body.replace(' ', '\n\n', 1)
+
+        if rng.random() < NEGATIVE_RATIO:
+            score = -rng.randrange(1, 20)
+        else:
+            score = int(rng.paretovariate(SCORE_ALPHA))
+
+        subreddit = rng.choices(subreddit_ids, cum_weights=subreddit_weights)[0]
+        created = str(int(start + i * step))
+
+        yield {
+            'author': 'user' + to_base36(rng.randrange(10 ** 6)),
+            'author_flair_css_class': None,
+            'author_flair_text': None,
+            'body': body,
+            'controversiality': 0,
+            'created_utc': created,
+            'distinguished': None,
+            'edited': False,
+            'gilded': 0,
+            'id': comment_id,
+            'link_id': 't3_' + to_base36(base // 100),
+            'name': 't1_' + comment_id,
+            'parent_id': parent_id,
+            'retrieved_on': int(end) + 86400,
+            'score': score,
+            'score_hidden': False,
+            'subreddit': 'sub' + to_base36(subreddit),
+            'subreddit_id': 't5_' + to_base36(subreddit),
+            'ups': max(score, 0),
+            'archived': False,
+            'downs': 0,
+        }
+
+
+def open_dump(path, compression='none'):
+    '''Open a dump for writing, compressed as downloaded from pushshift.
+
+    Args:
+        path -> Path to the dump, without the extension of the compression.
+        compression -> Default: 'none'. One of COMPRESSIONS.
+    Raises:
+        ImportError if the compression is 'zst' and the zstandard module is not installed.
+    Returns:
+        Binary file object.
+    '''
+    if compression == 'bz2':
+        return bz2.open(path + '.bz2', mode='wb')
+    elif compression == 'xz':
+        return lzma.open(path + '.xz', mode='wb')
+    elif compression == 'zst':
+        if zstandard is None:
+            raise ImportError('Writing zst dumps requires the "zstandard" module.')
+
+        return zstandard.ZstdCompressor().stream_writer(open(path + '.zst', mode='wb'), closefd=True)
+    else:
+        return open(path, mode='wb')
+
+
+def write_dump(raw_dir, timeframe, rows, seed=None, compression='none'):
+    '''Write a synthetic dump of a timeframe to the directory the raw dumps are read from. Any dump
+    of the timeframe already written with the same compression is replaced.
+
+    Args:
+        raw_dir -> Directory of the raw dumps, e.g. 'data/raw'.
+        timeframe -> Timeframe of the dump, e.g. '2015-01'.
+        rows -> Number of comments.
+        seed -> Default: None. Seed of the random generator.
+        compression -> Default: 'none'. One of COMPRESSIONS.
+    Returns:
+        Size of the decompressed dump in bytes.
+    '''
+    size = 0
+
+    with open_dump(os.path.join(raw_dir, 'RC_{}'.format(timeframe)), compression) as f:
+        for row in generate_rows(timeframe, rows, seed):
+            line = (json.dumps(row, separators=(',', ':')) + '\n').encode('utf-8')
+            f.write(line)
+            size += len(line)
+
+    return size
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write synthetic Reddit comments dumps for benchmarks.')
+
+    parser.add_argument('-t', '--timeframe', nargs='+', required=True, help='Timeframes of the dumps, e.g. 2015-01.')
+    parser.add_argument('-n', '--rows', type=int, default=100000, help='Number of comments per dump. Default: 100000.')
+    parser.add_argument('-d', '--directory', required=True, help='Directory the dumps are written to.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator. Default: 0.')
+    parser.add_argument('--compression', choices=COMPRESSIONS, default='none', help='Compression of the dumps. Default: none.')
+
+    args = parser.parse_args()
+
+    os.makedirs(args.directory, exist_ok=True)
+
+    for timeframe in args.timeframe:
+        size = write_dump(args.directory, timeframe, args.rows, args.seed, args.compression)
+        print('Wrote RC_{} with {} comments ({} bytes). Time: {}'.format(timeframe, args.rows, size, str(datetime.now())))
@@ -1,45 +1,193 @@
 import os
-import time
+import errno
+import csv
+import random
 from datetime import datetime
 
-import pandas as pd
-
 from poncho.utils.get_base_dir import get_base_dir
+from poncho.utils.open_log import open_log
+from poncho.utils.pairs_file import PairsReader
+from poncho.utils.telemetry import StageTelemetry
+from poncho.preprocess.convert_to_csv import prepared_path
+
+
+# Names of the datasets read by nmt_chatbot: training data, development data and test data.
+TRAIN = 'train'
+DEV = 'tst2012'
+TEST = 'tst2013'
+
+# Reason for which a prepared pair is not written to the datasets.
+EMPTY = 'empty'
+
+
+def read_pairs(path, telemetry=None):
+    '''Read the comment-reply pairs of a prepared CSV file one row at a time, skipping pairs with
+    an empty comment or reply.
+
+    Args:
+        path -> Path to the CSV file.
+        telemetry -> Default: None. StageTelemetry counting the pairs skipped.
+    Yields:
+        Tuples of (comment, reply).
+    '''
+    with open(path, mode='r', newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['comment'] and row['reply']:
+                yield row['comment'], row['reply']
+            elif telemetry is not None:
+                telemetry.reject(EMPTY)
+
+
+def read_pairs_file(path, telemetry=None):
+    '''Read the comment-reply pairs of a prepared pairs file one row at a time, skipping pairs with
+    an empty comment or reply. The 'id' column is never decompressed.
+
+    Args:
+        path -> Path to the pairs file.
+        telemetry -> Default: None. StageTelemetry counting the pairs skipped.
+    Yields:
+        Tuples of (comment, reply).
+    '''
+    with PairsReader(path) as reader:
+        for comment, reply in reader.read(('comment', 'reply')):
+            if comment and reply:
+                yield comment, reply
+            elif telemetry is not None:
+                telemetry.reject(EMPTY)
+
+
+def get_new_data_dir():
+    '''Get the directory of 'nmt_chatbot' where the datasets are read from, creating it if required.
+
+    Returns:
+        Path to the directory.
+    '''
+    new_data_dir = os.path.join(os.path.dirname(get_base_dir()), 'nmt_chatbot', 'new_data')
+
+    try:
+        os.makedirs(new_data_dir)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+        else:
+            pass
+
+    return new_data_dir
+
+
+class DatasetWriter(object):
+    '''Write comment-reply pairs to the training dataset and, optionally, to the development and
+    test datasets, choosing the dataset of every pair at random. The files are written under
+    temporary names and only replace the existing datasets once all of them are complete.
 
+    Usage:
+        with DatasetWriter(new_data_dir) as writer:
+            writer.write(comment, reply)
 
-def main(unique_years):
-    (BASE_DIR) = get_base_dir()
+    Args:
+        new_data_dir -> Directory the datasets are written to.
+        dev_fraction -> Default: 0. Fraction of the pairs written to the development dataset.
+        test_fraction -> Default: 0. Fraction of the pairs written to the test dataset.
+        seed -> Default: None. Seed of the random generator, for reproducible datasets.
+    '''
+    def __init__(self, new_data_dir, dev_fraction=0.0, test_fraction=0.0, seed=None):
+        self.dev_fraction = dev_fraction
+        self.test_fraction = test_fraction
+        self.rng = random.Random(seed)
+
+        self.datasets = [TRAIN]
+        if dev_fraction > 0:
+            self.datasets.append(DEV)
+        if test_fraction > 0:
+            self.datasets.append(TEST)
+
+        self.files = {}
+        self.counts = {}
+        for dataset in self.datasets:
+            self.files[dataset] = (
+                open(os.path.join(new_data_dir, '{}.from.tmp'.format(dataset)), mode='w', encoding='utf-8'),
+                open(os.path.join(new_data_dir, '{}.to.tmp'.format(dataset)), mode='w', encoding='utf-8'),
+            )
+            self.counts[dataset] = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, comment, reply):
+        '''Write a pair to one of the datasets.
+
+        Args:
+            comment -> Comment of the pair.
+            reply -> Reply to the comment.
+        '''
+        r = self.rng.random()
+
+        if r < self.dev_fraction:
+            dataset = DEV
+        elif r < self.dev_fraction + self.test_fraction:
+            dataset = TEST
+        else:
+            dataset = TRAIN
+
+        # Comments and replies are written to separate files, one pair per line.
+        self.files[dataset][0].write(comment + '\n')
+        self.files[dataset][1].write(reply + '\n')
+        self.counts[dataset] += 1
+
+    def close(self):
+        '''Replace the datasets with the files written.'''
+        for dataset in self.datasets:
+            for f in self.files[dataset]:
+                f.close()
+                os.replace(f.name, f.name[:-len('.tmp')])
+
+    def abort(self):
+        '''Remove the files written, leaving the existing datasets as they were.'''
+        for dataset in self.datasets:
+            for f in self.files[dataset]:
+                f.close()
+                os.remove(f.name)
+
+
+def main(unique_years, dev_fraction=0.0, test_fraction=0.0, seed=None, fmt='csv'):
+    # Directory of 'nmt_chatbot' where the datasets are read from
+    NEW_DATA_DIR = get_new_data_dir()
 
     # Log file
-    log = open(os.path.join(BASE_DIR, 'data', 'logs', 'train_{}.txt'.format(str(time.time()).split('.')[0])), mode='a')
+    log = open_log('train')
     
     log.write('Beginning to create training dataset. Time: {}\n\n'.format(str(datetime.now())))
     print('Beginning to create training dataset. Time: {}\n'.format(str(datetime.now())))
 
-    for year in unique_years:
-        log.write('Converting data of {} into train dataset\n. Time: {}'.format(year, str(datetime.now())))
-        print('Converting data of {} into train dataset. Time: {}'.format(year, str(datetime.now())))
-
-        # Open required CSV file
-        df = pd.read_csv(os.path.join(BASE_DIR, 'data', 'prepared', 'prepared_{}.csv'.format(year))).dropna()
-
-        # Convert the comments and replies to a Pandas DataFrame object
-        comment = pd.DataFrame(df['comment'])
-        reply = pd.DataFrame(df['reply'])
-
-        # Write the comments and replies to separate files in the directory of 'nmt-chatbot'
-        comment.to_csv(
-            os.path.join(os.path.dirname(BASE_DIR), 'nmt-chatbot', 'new_data', 'train.from'),
-            mode='w',
-            index=False,
-            header=None
-        )
-        reply.to_csv(
-            os.path.join(os.path.dirname(BASE_DIR), 'nmt-chatbot', 'new_data', 'train.to'),
-            mode='w',
-            index=False,
-            header=None
-        )
+    with DatasetWriter(NEW_DATA_DIR, dev_fraction, test_fraction, seed) as writer:
+        for year in unique_years:
+            log.write('Converting data of {} into train dataset. Time: {}\n'.format(year, str(datetime.now())))
+            print('Converting data of {} into train dataset. Time: {}'.format(year, str(datetime.now())))
+
+            with StageTelemetry('createtraindata', year) as telemetry:
+                path = prepared_path(year, fmt)
+                written = sum(writer.counts.values())
+
+                if fmt == 'pairs':
+                    pairs = read_pairs_file(path, telemetry)
+                else:
+                    pairs = read_pairs(path, telemetry)
+
+                for comment, reply in pairs:
+                    writer.write(comment, reply)
+
+                telemetry.accept(sum(writer.counts.values()) - written)
+                telemetry.read(telemetry.rows_accepted + telemetry.rows_rejected, os.path.getsize(path))
+
+    for dataset in writer.datasets:
+        print('Pairs written to {}: {}.'.format(dataset, writer.counts[dataset]))
+        log.write('Pairs written to {}: {}.\n'.format(dataset, writer.counts[dataset]))
 
     log.write('Finishing up... Time: {}\n'.format(str(datetime.now())))
     log.write('==========================================================================================\n\n')
@@ -2,13 +2,20 @@ from __future__ import absolute_import
 
 import sqlite3
 from datetime import datetime
-import time
 import os
 import errno
 from urllib.request import pathname2url
 
-from poncho.utils.transaction_builder import transaction_builder
+from poncho.utils.transaction_builder import TransactionBuilder
 from poncho.utils.get_base_dir import get_base_dir
+from poncho.utils.open_log import open_log
+from poncho.utils.sqlite_profile import apply_profile, finish_profile
+from poncho.utils.telemetry import StageTelemetry
+from poncho.preprocess.dirty_populate import create_indexes
+
+
+# Number of comments copied per statement when the dirty database is attached.
+ATTACH_CHUNK_SIZE = 100000
 
 
 def create_clean_table(cur):
@@ -33,62 +40,99 @@ def create_clean_table(cur):
     return cur
 
 
-def create_view(cur):
-    '''Create a view containing the comment, reply to the comment and the score of the comment and reply.
+def best_comment_and_replies_query(top_k=1, schema='main'):
+    '''Build the query obtaining the replies to every comment with the best possible score.
+    The comments are scanned in table order and the best replies to each one are looked up in the
+    (parent_id, score) index of rc_reply, so nothing has to be sorted or grouped and only the rows of
+    the selected replies are read.
 
     Args:
-        cur -> Database cursor.
+        top_k -> Default: 1. Number of replies returned for every comment.
+        schema -> Default: 'main'. Schema of the dirty database, e.g. the name it is attached as.
     Returns:
-        Database cursor.
+        SQL query.
+        Query parameters.
     '''
-    sql = '''
-    CREATE VIEW IF NOT EXISTS comment_reply
-    AS
-        SELECT
-            rc_comment.comment AS comment,
-            rc_reply.comment AS reply,
-            rc_comment.score AS comment_score,
-            rc_reply.score AS reply_score
-        FROM rc_comment INNER JOIN rc_reply ON rc_comment.comment_id = rc_reply.parent_id
+    if top_k == 1:
+        best_replies = 'rc_reply.rowid = (SELECT rowid FROM {0}.rc_reply WHERE parent_id = rc_comment.comment_id ORDER BY score DESC LIMIT 1)'
+        params = ()
+    else:
+        best_replies = 'rc_reply.rowid IN (SELECT rowid FROM {0}.rc_reply WHERE parent_id = rc_comment.comment_id ORDER BY score DESC LIMIT ?)'
+        params = (top_k,)
+
+    query = '''
+    SELECT
+        rc_comment.comment AS comment,
+        rc_reply.comment AS reply,
+        rc_comment.score AS comment_score,
+        rc_reply.score AS reply_score
+    FROM {0}.rc_comment CROSS JOIN {0}.rc_reply ON ''' + best_replies + '''
     '''
-    try:
-        cur = cur.execute(sql)
-    except Exception as e:
-        raise e
 
-    return cur
+    return query.format(schema), params
 
 
-def get_best_comment_and_replies(cur):
-    '''Query the database to obtain a reply to the comment with the best possible score.
+def get_best_comment_and_replies(cur, top_k=1):
+    '''Query the database to obtain the replies to every comment with the best possible score.
     The result of the query will NOT be fetched by this function.
 
     Args:
         cur -> Database cursor.
+        top_k -> Default: 1. Number of replies returned for every comment.
     Returns:
         Database cursor.
     '''
-    query = '''
-    SELECT comment, reply, comment_score, MAX(reply_score) AS max_reply_score
-    FROM comment_reply
-    GROUP BY comment
-    '''
-    cur = cur.execute(query)
+    query, params = best_comment_and_replies_query(top_k)
+    cur = cur.execute(query, params)
 
     return cur
 
 
-def insert_comment_and_reply(conn, cur, **kwargs):
-    '''Insert the obtained comment and reply to the new table.
+def attach_dirty_database(cur, path):
+    '''Attach a dirty database to the connection of the clean database, read-only, as 'dirty'.
 
     Args:
-        conn -> Database connection.
-        cur -> Database cursor.
-        Required keyword arguments: comment, reply, comment_score, reply_score.
+        cur -> Cursor of the clean database, opened with uri=True.
+        path -> Path to the dirty database.
     Returns:
-        Database connection.
         Database cursor.
     '''
+    cur = cur.execute('ATTACH DATABASE ? AS dirty', ('file:{}?mode=ro'.format(pathname2url(path)),))
+
+    return cur
+
+
+def copy_best_comment_and_replies(cur, first, last, top_k=1):
+    '''Copy the best comments and replies of a range of comments from the attached dirty database to
+    rc_cleaned with a single INSERT ... SELECT, without the rows going through Python.
+
+    Args:
+        cur -> Cursor of the clean database with the dirty database attached as 'dirty'.
+        first -> rowid of the first comment of the range.
+        last -> rowid of the last comment of the range.
+        top_k -> Default: 1. Number of replies copied for every comment.
+    Returns:
+        Database cursor. Its rowcount is the number of rows inserted.
+    '''
+    query, params = best_comment_and_replies_query(top_k, schema='dirty')
+
+    sql = '''
+    INSERT INTO rc_cleaned (comment, reply, comment_score, reply_score)
+    ''' + query + '''
+    WHERE rc_comment.rowid BETWEEN ? AND ?
+    '''
+    cur = cur.execute(sql, params + (first, last))
+
+    return cur
+
+
+def insert_comment_and_reply(builder, **kwargs):
+    '''Queue the obtained comment and reply to be inserted into the new table.
+
+    Args:
+        builder -> TransactionBuilder of the clean database connection.
+        Required keyword arguments: comment, reply, comment_score, reply_score.
+    '''
     if 'comment' not in kwargs:
         raise KeyError('Missing Argument: comment')
     elif 'reply' not in kwargs:
@@ -110,29 +154,26 @@ def insert_comment_and_reply(conn, cur, **kwargs):
         kwargs['reply_score'],
     ]
 
-    conn, cur = transaction_builder(conn, cur, query, args)
-
-    return conn, cur
+    builder.add(query, args)
 
 
-def main(unique_years):
-    row_counter = 0
+def main(unique_years, batch_size=1000, profile='safe', top_k=1, attach=False):
 
     # Base Directory
     BASE_DIR = get_base_dir()
 
     # Check if some directories exist or not
-    try:
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'logs'))
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'processed'))
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise e
-        else:
-            pass
+    for directory in ('logs', 'processed'):
+        try:
+            os.makedirs(os.path.join(BASE_DIR, 'data', directory))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+            else:
+                pass
 
     try:
-        log = open(os.path.join(BASE_DIR, 'data', 'logs', 'clean_{}.txt'.format(str(time.time()).split('.')[0])), mode='a')
+        log = open_log('clean')
 
         log.write('Beginning to cleanup the data from the database. Time: {}\n\n'.format(str(datetime.now())))
         print('Beginning to cleanup the data from the database. Time: {}\n'.format(str(datetime.now())))
@@ -140,63 +181,116 @@ def main(unique_years):
         for year in unique_years:
             log.write('Cleaning data of {}. Time: {}\n\n'.format(year, str(datetime.now())))
 
-            # Database connections.
-            try:
-                dirty_conn = sqlite3.connect(
-                    'file:{}?mode=ro'.format(
+            row_counter = 0
+
+            with StageTelemetry('cleanupdb', year) as telemetry:
+                dirty_path = os.path.join(BASE_DIR, 'data', 'processed', 'RC_dirty_{}.db'.format(year))
+
+                # Database connections.
+                try:
+                    dirty_conn = sqlite3.connect(
+                        'file:{}?mode=rw'.format(pathname2url(dirty_path)),
+                        uri=True
+                    )
+                    dirty_conn = apply_profile(dirty_conn, profile, readonly=True)
+                    dirty_cur = dirty_conn.cursor()
+                except sqlite3.OperationalError:
+                    print('Error: RC_dirty_{0}.db does not exist.\nYou may have forgotten to run "createdirtydb" or have deleted the required database file.'.format(year))
+                    exit(errno.EIO)
+
+                clean_conn = sqlite3.connect(
+                    'file:{}?mode=rwc'.format(
                         pathname2url(
-                            os.path.join(BASE_DIR, 'data', 'processed', 'RC_dirty_{}.db'.format(year))
+                            os.path.join(BASE_DIR, 'data', 'processed', 'RC_clean_{}.db'.format(year))
                         )
                     ),
                     uri=True
                 )
-                dirty_cur = dirty_conn.cursor()
-            except sqlite3.OperationalError:
-                print('Error: RC_dirty_{0}.db does not exist.\nYou may have forgotten to run "createdirtydb" or have deleted the required database file.'.format(year))
-                exit(errno.EIO)
-
-            clean_conn = sqlite3.connect(
-                'file:{}?mode=rwc'.format(
-                    pathname2url(
-                        os.path.join(BASE_DIR, 'data', 'processed', 'RC_clean_{}.db'.format(year))
-                    )
-                ),
-                uri=True
-            )
-            clean_cur = clean_conn.cursor()
-
-            # Create the table.
-            clean_cur = create_clean_table(clean_cur)
-
-            # Create a view containing comment, reply to the comment and the scores of the comment and reply.
-            dirty_cur = create_view(dirty_cur)
-
-            # Get the best comment and replies.
-            dirty_cur = get_best_comment_and_replies(dirty_cur)
-
-            # Insert the values into the database.
-            while True:
-                row = dirty_cur.fetchone()
-
-                # Check if 'row' is empty.
-                if not row:
-                    break
-
-                row_counter += 1
-
-                # Pass the result to be inserted into the database.
-                clean_conn, clean_cur = insert_comment_and_reply(
-                    clean_conn,
-                    clean_cur,
-                    comment=row[0],
-                    reply=row[1],
-                    comment_score=row[2],
-                    reply_score=row[3]
-                )
+                clean_conn = apply_profile(clean_conn, profile)
+                clean_cur = clean_conn.cursor()
+
+                # Create the table.
+                clean_cur = create_clean_table(clean_cur)
+
+                # Index the replies by parent if the dirty database was created without the index.
+                dirty_cur = create_indexes(dirty_cur)
+                dirty_conn.commit()
+
+                if attach:
+                    dirty_cur.close()
+                    dirty_conn.close()
+
+                    # Copy the data inside SQLite, one range of comments at a time to be able to report progress.
+                    clean_cur = attach_dirty_database(clean_cur, dirty_path)
+                    first, last = clean_cur.execute('SELECT MIN(rowid), MAX(rowid) FROM dirty.rc_comment').fetchone()
+
+                    if first is not None:
+                        for start in range(first, last + 1, ATTACH_CHUNK_SIZE):
+                            clean_cur = copy_best_comment_and_replies(clean_cur, start, start + ATTACH_CHUNK_SIZE - 1, top_k)
+                            clean_conn.commit()
+
+                            inserted = clean_cur.rowcount
+                            row_counter += inserted
 
-                if row_counter % 10000 == 0:
-                    print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
-                    log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
+                            # Rows read are the comments scanned, in both modes, of which the best are copied.
+                            telemetry.read(clean_cur.execute(
+                                'SELECT COUNT(*) FROM dirty.rc_comment WHERE rowid BETWEEN ? AND ?',
+                                (start, start + ATTACH_CHUNK_SIZE - 1)
+                            ).fetchone()[0])
+                            telemetry.accept(inserted)
+                            telemetry.progress()
+
+                            print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
+                            log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
+
+                    clean_cur.execute('DETACH DATABASE dirty')
+
+                    print('Rows inserted: {}.'.format(row_counter))
+                    log.write('Rows inserted: {}.\n'.format(row_counter))
+                else:
+                    # Rows read are the comments scanned, in both modes. The query scans all of them.
+                    comments = dirty_cur.execute('SELECT COUNT(*) FROM rc_comment').fetchone()[0]
+
+                    # Get the best comment and replies.
+                    dirty_cur = get_best_comment_and_replies(dirty_cur, top_k)
+
+                    # Insert the values into the database.
+                    with TransactionBuilder(clean_conn, batch_size) as builder:
+                        for row in dirty_cur:
+                            row_counter += 1
+
+                            # Pass the result to be inserted into the database.
+                            insert_comment_and_reply(
+                                builder,
+                                comment=row[0],
+                                reply=row[1],
+                                comment_score=row[2],
+                                reply_score=row[3]
+                            )
+
+                            if row_counter % 10000 == 0:
+                                telemetry.progress()
+
+                                print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
+                                log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
+
+                    telemetry.read(comments)
+                    telemetry.accept(builder.inserted)
+                    telemetry.reject('database', builder.failed)
+
+                    print('Rows inserted: {}. Rows rejected by the database: {}.'.format(builder.inserted, builder.failed))
+                    log.write('Rows inserted: {}. Rows rejected by the database: {}.\n'.format(builder.inserted, builder.failed))
+
+                    dirty_cur.close()
+                    dirty_conn.close()
+
+                clean_conn = finish_profile(clean_conn, profile)
+
+                clean_cur.close()
+                clean_conn.close()
+
+                telemetry.read(0, os.path.getsize(dirty_path))
+                telemetry.written(os.path.getsize(os.path.join(BASE_DIR, 'data', 'processed', 'RC_clean_{}.db'.format(year))))
 
         # Print and log the finishing statement.
         print('Finishing up.. Time: {}'.format(str(datetime.now())))
@@ -205,10 +299,3 @@ def main(unique_years):
         log.close()
     except Exception as e:
         raise e
-
-    # Close all database connections.
-    dirty_cur.close()
-    dirty_conn.close()
-
-    clean_cur.close()
-    clean_conn.close()
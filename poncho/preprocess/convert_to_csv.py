@@ -1,13 +1,31 @@
 import os
 import errno
+import csv
 from datetime import datetime
-import time
 import sqlite3
 
-import pandas as pd
-from sklearn.utils import shuffle
-
 from poncho.utils.get_base_dir import get_base_dir
+from poncho.utils.open_log import open_log
+from poncho.utils.sqlite_profile import apply_profile
+from poncho.utils.shuffle import estimate_size, shuffle_rows
+from poncho.utils.pairs_file import PairsWriter, EXTENSION
+from poncho.utils.dedup import create_deduplicator
+from poncho.utils.telemetry import StageTelemetry
+
+
+# Default memory available for shuffling the pairs of a year, in bytes.
+MEMORY_BUDGET = 1 << 30
+
+# Formats the prepared pairs can be written in, with the extension of their files.
+#   csv -> CSV file with an 'id', 'comment' and 'reply' column.
+#   pairs -> Compressed columnar file with the same columns, see poncho.utils.pairs_file.
+FORMATS = {
+    'csv': '.csv',
+    'pairs': EXTENSION,
+}
+
+# Columns of the prepared pairs.
+COLUMNS = (('id', 'int'), ('comment', 'str'), ('reply', 'str'))
 
 
 def create_table(cur):
@@ -36,51 +54,142 @@ def create_table(cur):
     return cur
 
 
-def main(unique_years):
+def write_csv(rows, path):
+    '''Write the comment-reply pairs to a CSV file. The file is written under a temporary name and
+    renamed once complete, so it is replaced as a whole and never left half written.
+
+    Args:
+        rows -> Iterable over (id, comment, reply) rows.
+        path -> Path to the CSV file.
+    Returns:
+        Number of rows written.
+    '''
+    count = 0
+
+    with open(path + '.tmp', mode='w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(('id', 'comment', 'reply'))
+
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+
+    os.replace(path + '.tmp', path)
+
+    return count
+
+
+def write_pairs(rows, path):
+    '''Write the comment-reply pairs to a pairs file.
+
+    Args:
+        rows -> Iterable over (id, comment, reply) rows.
+        path -> Path to the pairs file.
+    Returns:
+        Number of rows written.
+    '''
+    with PairsWriter(path, COLUMNS) as writer:
+        for row in rows:
+            writer.write(row)
+
+    return writer.rows
+
+
+def prepared_path(year, fmt='csv'):
+    '''Get the path of the prepared pairs of a year.
+
+    Args:
+        year -> Year of the pairs.
+        fmt -> Default: 'csv'. One of FORMATS.
+    Returns:
+        Path to the file.
+    '''
+    return os.path.join(get_base_dir(), 'data', 'prepared', 'prepared_{}{}'.format(year, FORMATS[fmt]))
+
+
+def main(unique_years, profile='safe', memory_budget=MEMORY_BUDGET, seed=None, fmt='csv', dedup=False, max_repeats=None, near_threshold=None):
     BASE_DIR = get_base_dir()
 
     # Try to create some required files if they do not exist already
-    try:
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'prepared'))
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'logs'))
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise e
-        else:
-            pass
+    for directory in ('prepared', 'logs'):
+        try:
+            os.makedirs(os.path.join(BASE_DIR, 'data', directory))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+            else:
+                pass
 
     try:
-        log = open(os.path.join(BASE_DIR, 'data', 'logs', 'prepared_{}.txt'.format(str(time.time()).split('.')[0])), mode='a')
+        log = open_log('prepared')
         
         log.write('Beginning preparation of data. Time: {}\n\n'.format(str(datetime.now())))
         print('Beginning preparation of data. Time: {}\n'.format(str(datetime.now())))
 
         for year in unique_years:
-            log.write('Preparing data of {}. Time: {}'.format(year, str(datetime.now())))
+            log.write('Preparing data of {}. Time: {}\n'.format(year, str(datetime.now())))
             print('Preparing data of {}. Time: {}'.format(year, str(datetime.now())))
 
-            # Database connections
-            try:
-                clean_conn = sqlite3.connect(
-                    'file:{}?mode=rw'.format(
-                        os.path.join(BASE_DIR, 'data', 'processed', 'RC_clean_{}.db'.format(year))
-                    ),
-                    uri=True
-                )
-                clean_cur = clean_conn.cursor()
-            except sqlite3.OperationalError:
-                print('Error: RC_clean_{}.db does not exist. \nYou may have forgotten to run "cleanupdb" or have deleted the required database file.'.format(year))
-                exit(errno.EIO)
-
-            # Create the required table
-            clean_cur = create_table(clean_cur)
-
-            # Get all the data from the cleaned database to a Pandas DataFrame
-            df = pd.read_sql_query('SELECT * FROM best_comment_reply', clean_conn, index_col='id')
-            # Shuffle the data
-            df = shuffle(df)
-            # Write all the data to a CSV file
-            df.to_csv(os.path.join(BASE_DIR, 'data', 'prepared', 'prepared_{}.csv'.format(year)), mode='a')
+            with StageTelemetry('preparedata', year) as telemetry:
+                # Database connections
+                try:
+                    clean_conn = sqlite3.connect(
+                        'file:{}?mode=rw'.format(
+                            os.path.join(BASE_DIR, 'data', 'processed', 'RC_clean_{}.db'.format(year))
+                        ),
+                        uri=True
+                    )
+                    # Only the pairs table is written here, so the database is not bulk loaded or compacted.
+                    clean_conn = apply_profile(clean_conn, profile, readonly=True)
+                    clean_cur = clean_conn.cursor()
+                except sqlite3.OperationalError:
+                    print('Error: RC_clean_{}.db does not exist. \nYou may have forgotten to run "cleanupdb" or have deleted the required database file.'.format(year))
+                    exit(errno.EIO)
+
+                # Create the required table
+                clean_cur = create_table(clean_cur)
+                clean_conn.commit()
+
+                # Estimate the memory needed to shuffle the pairs, to decide whether they fit in the budget.
+                count, chars = clean_cur.execute(
+                    'SELECT COUNT(*), TOTAL(LENGTH(comment) + LENGTH(reply)) FROM best_comment_reply'
+                ).fetchone()
+                size = estimate_size(count, int(chars))
+
+                # Stream the pairs out of the database, shuffle them and write them to the prepared file. The
+                # table is scanned in the order it was filled from rc_cleaned, without sorting it.
+                clean_cur = clean_cur.execute('SELECT id, comment, reply FROM best_comment_reply')
+
+                # Drop duplicate pairs as they are read; the first copy of a pair is kept.
+                deduplicator = create_deduplicator(dedup, max_repeats, near_threshold)
+                if deduplicator is None:
+                    rows = clean_cur
+                else:
+                    rows = (row for row in clean_cur if deduplicator.keep(row[1], row[2]))
+
+                rows = shuffle_rows(rows, size, memory_budget, seed)
+
+                if fmt == 'pairs':
+                    written = write_pairs(rows, prepared_path(year, fmt))
+                else:
+                    written = write_csv(rows, prepared_path(year, fmt))
+
+                telemetry.read(count)
+                telemetry.accept(written)
+                if deduplicator is not None:
+                    telemetry.reject_all(deduplicator.removed)
+                telemetry.written(os.path.getsize(prepared_path(year, fmt)))
+
+            if deduplicator is not None:
+                print(deduplicator.report())
+                log.write(deduplicator.report() + '\n')
+
+            print('Rows written: {}.'.format(written))
+            log.write('Rows written: {}.\n'.format(written))
+
+            # Close connections
+            clean_cur.close()
+            clean_conn.close()
 
         log.write('Finishing up... Time: {}\n'.format(str(datetime.now())))
         log.write('===================================================================================\n\n')
@@ -88,6 +197,4 @@ def main(unique_years):
     except Exception as e:
         raise e
 
-    # Close connections
-    clean_cur.close()
-    clean_conn.close()
+    log.close()
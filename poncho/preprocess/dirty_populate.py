@@ -2,37 +2,97 @@ from __future__ import absolute_import
 
 import sqlite3
 import json
-import time
 from datetime import datetime
 import os
 import errno
+from collections import deque, Counter
+from multiprocessing import Pool
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from poncho.utils.get_base_dir import get_base_dir
-from poncho.utils.transaction_builder import transaction_builder
+from poncho.utils.open_log import open_log
+from poncho.utils.transaction_builder import TransactionBuilder
 from poncho.utils.reformat import reformat
-
-
-def create_tables(cur):
+from poncho.utils.sqlite_profile import apply_profile, finish_profile
+from poncho.utils.read_dump import find_dump, read_batches, detect_compression, split_dump, read_range
+from poncho.utils.telemetry import StageTelemetry
+
+
+# Number of lines parsed together, and how often the progress is reported.
+BATCH_LINES = 10000
+# Size of the byte ranges of an uncompressed dump handed to each parse worker.
+RANGE_SIZE = 1 << 24
+
+# Statements inserting comments and replies. The order of the values matches the rows returned by
+# parse_row, without the parent ID in the case of comments.
+INSERT_COMMENT = '''
+INSERT INTO rc_comment (comment_id, created_unix, score, comment, subreddit)
+VALUES (?, ?, ?, ?, ?)
+'''
+INSERT_REPLY = '''
+INSERT INTO rc_reply (parent_id, comment_id, created_unix, score, comment, subreddit)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+# Unique indexes on comment_id replacing the primary keys of tables created by bulk loads.
+UNIQUE_KEYS = (
+    ('rc_comment', 'rc_comment_comment_id'),
+    ('rc_reply', 'rc_reply_comment_id'),
+)
+
+# Secondary indexes, built once the data has been loaded. Replies are looked up by their parent in
+# the order of their score to find the best replies to a comment.
+INDEXES = (
+    ('rc_reply_parent_id', 'rc_reply (parent_id, score DESC)'),
+)
+
+# Statement recording how far the dump of a timeframe has been ingested.
+SAVE_CHECKPOINT = '''
+INSERT OR REPLACE INTO ingest_checkpoint (timeframe, dump_size, offset, rows, done)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+# Key of the body as it appears in the raw rows, with and without a space after the colon.
+BODY_KEYS = (b'"body":"', b'"body": "')
+
+# Reasons for which a row of the dump is not inserted into the database.
+TOO_MANY_WORDS = 'too_many_words'
+EMPTY = 'empty'
+TOO_LONG = 'too_long'
+DELETED = 'deleted'
+UNSUPPORTED_PARENT = 'unsupported_parent'
+DUPLICATE = 'duplicate'
+
+
+def create_tables(cur, keyed=True):
     '''Create two tables for the specified year; one to store the parent comments
     and the other to store replies to the parent.
 
     Args:
         cur -> Database cursor.
+        keyed -> Default: True. Set to False to create the tables without a primary key; a unique
+                 index on comment_id is then built by create_keys once the data is loaded.
     Returns:
         Database cursor.
     '''
+    key = ' PRIMARY KEY' if keyed else ''
+
     parent = '''
     CREATE TABLE IF NOT EXISTS rc_comment (
-        comment_id TEXT PRIMARY KEY,
+        comment_id TEXT{},
         created_unix INT,
         score INT,
         comment TEXT,
         subreddit TEXT
     );
-    '''
+    '''.format(key)
     reply = '''
     CREATE TABLE IF NOT EXISTS rc_reply (
-        comment_id TEXT PRIMARY KEY,
+        comment_id TEXT{},
         parent_id TEXT,
         created_unix INT,
         score INT,
@@ -40,20 +100,133 @@ def create_tables(cur):
         subreddit TEXT,
         FOREIGN KEY(parent_id) REFERENCES rc_parent(comment_id)
     )
-    '''
+    '''.format(key)
     cur.execute(parent)
     cur.execute(reply)
 
     return cur
 
 
-def insert_to_table(conn, cur, has_parent=False, **kwargs):
-    '''Generate an INSERT statement to insert a Reddit comment into the database. The statement will
-    then be passed to another function to create a transaction.
+def create_checkpoint_table(cur):
+    '''Create the table recording how far the dump of every timeframe has been ingested. Its rows
+    are committed together with the rows of the dump they account for.
+
+    Args:
+        cur -> Database cursor.
+    Returns:
+        Database cursor.
+    '''
+    sql = '''
+    CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+        timeframe TEXT PRIMARY KEY,
+        dump_size INT,
+        offset INT,
+        rows INT,
+        done INT
+    )
+    '''
+    cur.execute(sql)
+
+    return cur
+
+
+def get_checkpoint(cur, timeframe):
+    '''Get the last checkpoint of a timeframe.
+
+    Args:
+        cur -> Database cursor.
+        timeframe -> Timeframe of the dump.
+    Returns:
+        Tuple of (dump_size, offset, rows, done), or None if the timeframe has no checkpoint.
+    '''
+    return cur.execute(
+        'SELECT dump_size, offset, rows, done FROM ingest_checkpoint WHERE timeframe = ?',
+        (timeframe,)
+    ).fetchone()
+
+
+def has_primary_key(cur, table):
+    '''Check if a table has a primary key.
+
+    Args:
+        cur -> Database cursor.
+        table -> Name of the table.
+    Returns:
+        True if one of the columns of the table is a primary key.
+    '''
+    return any(column[5] for column in cur.execute('PRAGMA table_info({})'.format(table)).fetchall())
+
+
+def drop_indexes(cur):
+    '''Drop the secondary indexes and the unique indexes on comment_id of tables created without a
+    primary key, so that they are not updated row by row during a load. Tables having a primary key
+    keep it.
+
+    Args:
+        cur -> Database cursor.
+    Returns:
+        Database cursor.
+    '''
+    for table, index in UNIQUE_KEYS:
+        if not has_primary_key(cur, table):
+            cur.execute('DROP INDEX IF EXISTS {}'.format(index))
+
+    for index, _ in INDEXES:
+        cur.execute('DROP INDEX IF EXISTS {}'.format(index))
+
+    return cur
+
+
+def create_indexes(cur):
+    '''Create the secondary indexes used to query the tables, if they do not exist yet.
 
     Args:
-        conn -> Database connection.
         cur -> Database cursor.
+    Returns:
+        Database cursor.
+    '''
+    for index, columns in INDEXES:
+        cur.execute('CREATE INDEX IF NOT EXISTS {} ON {}'.format(index, columns))
+
+    return cur
+
+
+def create_keys(cur):
+    '''Build the unique indexes on comment_id of tables created without a primary key. Like a primary
+    key would have done, only the first row inserted for every comment_id is kept.
+
+    Args:
+        cur -> Database cursor.
+    Returns:
+        Database cursor.
+        Number of duplicate rows that were removed.
+    '''
+    removed = 0
+
+    for table, index in UNIQUE_KEYS:
+        if has_primary_key(cur, table):
+            continue
+
+        sql = 'CREATE UNIQUE INDEX IF NOT EXISTS {} ON {} (comment_id)'.format(index, table)
+
+        try:
+            cur.execute(sql)
+        except sqlite3.IntegrityError:
+            cur.execute(
+                'DELETE FROM {0} WHERE rowid NOT IN (SELECT MIN(rowid) FROM {0} GROUP BY comment_id)'.format(table)
+            )
+            removed += cur.rowcount
+
+            cur.execute(sql)
+
+    return cur, removed
+
+
+def insert_to_table(builder, has_parent=False, **kwargs):
+    '''Queue a Reddit comment to be inserted into the database by a transaction builder.
+
+    Args:
+        builder -> TransactionBuilder of the database connection.
         has_parent -> Default: False. Set to True if the comment is a reply to another comment.
         comment_id -> ID of the comment. Primary Key in database.
         parent_id -> Required only if the comment is a reply (has_parent=True).
@@ -63,9 +236,6 @@ def insert_to_table(conn, cur, has_parent=False, **kwargs):
         comment -> Body of the comment.
     Raises:
         KeyError if any of the required arguments are not present.
-    Returns:
-        Database connection.
-        Database cursor.
     '''
     if 'comment_id' not in kwargs:
         raise KeyError('Missing Argument: comment_id')
@@ -82,41 +252,62 @@ def insert_to_table(conn, cur, has_parent=False, **kwargs):
         if 'parent_id' not in kwargs:
             raise KeyError('Missing Argument: parent_id')
         else:
-            ins_parent = '''
-            INSERT INTO rc_reply (comment_id, parent_id, created_unix, score, comment, subreddit)
-            VALUES (?, ?, ?, ?, ?, ?)
-            '''
-            args = [
-                kwargs['comment_id'],
+            insert_row(builder, (
                 kwargs['parent_id'],
+                kwargs['comment_id'],
                 kwargs['created_unix'],
                 kwargs['score'],
                 kwargs['comment'],
                 kwargs['subreddit'],
-            ]
-
-            conn, cur = transaction_builder(conn, cur, ins_parent, args)
+            ))
     else:
-        ins_no_parent = '''
-        INSERT INTO rc_comment (comment_id, created_unix, score, comment, subreddit)
-        VALUES (?, ?, ?, ?, ?)
-        '''
-        args = [
+        insert_row(builder, (
+            None,
             kwargs['comment_id'],
             kwargs['created_unix'],
             kwargs['score'],
             kwargs['comment'],
             kwargs['subreddit'],
-        ]
+        ))
 
-        conn, cur = transaction_builder(conn, cur, ins_no_parent, args)
 
-    return conn, cur
+def insert_row(builder, row):
+    '''Queue a row returned by parse_row to be inserted into the table it belongs to.
+
+    Args:
+        builder -> TransactionBuilder of the database connection.
+        row -> Row to be inserted.
+    '''
+    if row[0] is None:
+        builder.add(INSERT_COMMENT, row[1:])
+    else:
+        builder.add(INSERT_REPLY, row)
+
+
+def rejection_reason(txt):
+    '''Get the reason a string is not acceptable, if any. This function will check the length of
+    the string and if the comment has been deleted or removed.
+
+    Args:
+        txt -> String to be checked.
+    Returns:
+        None if the string is acceptable.
+        One of TOO_MANY_WORDS, EMPTY, TOO_LONG or DELETED if the string is not acceptable.
+    '''
+    if len(txt.split(' ')) > 50:
+        return TOO_MANY_WORDS
+    elif len(txt) < 1:
+        return EMPTY
+    elif len(txt) > 1000:
+        return TOO_LONG
+    elif txt == '[removed]' or txt == '[deleted]':
+        return DELETED
+    else:
+        return None
 
 
 def acceptable(txt):
-    '''Decide whether a string is acceptable or not. This function will check the length of the
-    string and if the comment has been deleted or removed.
+    '''Decide whether a string is acceptable or not, see rejection_reason.
 
     Args:
         txt -> String to be checked.
@@ -124,135 +315,339 @@ def acceptable(txt):
         True if the string is acceptable.
         False if the string is not acceptable.
     '''
-    if len(txt.split(' ')) > 50 or len(txt) < 1 or len(txt) > 1000:
-        return False
-    elif txt == '[removed]' or txt == '[deleted]':
-        return False
+    return rejection_reason(txt) is None
+
+
+def loads(line):
+    '''Decode a row of the dump, using orjson when it is installed. Rows orjson refuses (e.g. lone
+    surrogates) are decoded by the json module, so the result is always the same as json.loads.
+
+    Args:
+        line -> Row of the dump as a JSON document.
+    Returns:
+        Decoded row.
+    '''
+    if orjson is not None:
+        try:
+            return orjson.loads(line)
+        except ValueError:
+            pass
+
+    return json.loads(line)
+
+
+def prefilter(line):
+    '''Cheaply decide from the raw bytes of a row whether parse_row could accept it, so that most
+    rows that are thrown away never have to be decoded. Only the body is inspected: bodies without
+    escape sequences get the same checks as acceptable, bodies with escape sequences are only
+    checked for having too many words since unescaping can never remove a space.
+
+    Args:
+        line -> Row of the dump as bytes.
+    Returns:
+        The reason given by rejection_reason if parse_row would certainly skip the row.
+        None if the row has to be parsed.
+    '''
+    for key in BODY_KEYS:
+        start = line.find(key)
+
+        if start != -1:
+            break
     else:
-        return True
+        return None
+
+    # The key has to be unique, otherwise it could belong to a nested object.
+    if line.rfind(key) != start:
+        return None
+
+    start += len(key)
+    end = line.find(b'"', start)
+
+    if line.find(b'\\', start, end) != -1:
+        # The quote found may be an escaped one, in which case only a prefix of the body is checked.
+        return TOO_MANY_WORDS if line.count(b' ', start, end) >= 50 else None
+
+    # reformat leaves bodies without escape sequences unchanged, so the checks are exact.
+    if line.count(b' ', start, end) >= 50:
+        return TOO_MANY_WORDS
+    elif end == start:
+        return EMPTY
+    elif end - start == 9 and line[start:end] in (b'[deleted]', b'[removed]'):
+        return DELETED
+    elif end - start > 1000:
+        # Only count characters when the body may be too long.
+        try:
+            return TOO_LONG if len(line[start:end].decode('utf-8')) > 1000 else None
+        except UnicodeDecodeError:
+            return None
+    else:
+        return None
+
+
+def parse_row(line):
+    '''Decode a row of the dump and check if it has to be inserted into the database.
+
+    Args:
+        line -> Row of the dump as a JSON document.
+    Returns:
+        Row to be inserted as a tuple of (parent_id, comment_id, created_unix, score, comment,
+        subreddit), or None if the row is skipped. parent_id is None for comments that are not
+        replies to another comment.
+        Reason the row is skipped, e.g. UNSUPPORTED_PARENT, or None if it has to be inserted.
+    '''
+    # Load the data row as JSON.
+    row = loads(line)
+
+    parent_type, _, parent_id = row['parent_id'].partition('_')
+
+    if parent_type == 't3':
+        parent_id = None
+    elif parent_type != 't1':
+        return None, UNSUPPORTED_PARENT
+
+    comment = reformat(row['body'])
+
+    reason = rejection_reason(comment)
+    if reason is not None:
+        return None, reason
+
+    return (parent_id, row['id'], row['created_utc'], row['score'], comment, row['subreddit']), None
+
+
+def parse_lines(lines):
+    '''Parse a batch of rows of the dump. Used by the parse workers.
+
+    Args:
+        lines -> Rows of the dump.
+    Returns:
+        Number of rows parsed.
+        List of the rows to be inserted, as returned by parse_row.
+        Counter of the rows skipped by reason.
+    '''
+    rows = []
+    rejected = Counter()
+
+    for line in lines:
+        # Skip rows that can be rejected without decoding them.
+        reason = prefilter(line)
+
+        if reason is None:
+            row, reason = parse_row(line)
+
+            if row is not None:
+                rows.append(row)
+                continue
+
+        rejected[reason] += 1
+
+    return len(lines), rows, rejected
+
+
+def parse_range(task):
+    '''Parse a byte range of an uncompressed dump. Used by the parse workers.
+
+    Args:
+        task -> Tuple of (path, start, end) identifying the range.
+    Returns:
+        Same as parse_lines.
+    '''
+    path, start, end = task
 
+    return parse_lines(read_range(path, start, end))
 
-def main(timeframes):
-    row_counter = 0
 
+def parse_dump(path, pool=None, workers=1, start=0):
+    '''Parse all the rows of a dump, optionally spreading the work over a pool of processes.
+    Uncompressed dumps are split into byte ranges which the workers read themselves, the lines of
+    compressed dumps are read here and sent to the workers in batches. Results are returned in
+    the order of the dump and the number of pending batches is bounded so that the workers never
+    run far ahead of the database writer.
+
+    Args:
+        path -> Path to the dump.
+        pool -> Default: None. Pool of parse workers. The dump is parsed in this process if None.
+        workers -> Default: 1. Number of processes in the pool.
+        start -> Default: 0. Offset of the decompressed dump at which parsing starts, e.g. the offset
+                 of a checkpoint.
+    Yields:
+        Tuples of (end, lines_parsed, rows, rejected) for every batch of rows, where 'end' is the
+        offset of the decompressed dump following the batch and the rest is the same as returned
+        by parse_lines.
+    '''
+    if pool is None:
+        for end, lines in read_batches(path, BATCH_LINES, start):
+            yield (end,) + parse_lines(lines)
+        return
+
+    if detect_compression(path) is None:
+        tasks = (
+            (end, parse_range, (path, range_start, end))
+            for range_start, end in split_dump(path, RANGE_SIZE, start)
+        )
+    else:
+        tasks = ((end, parse_lines, lines) for end, lines in read_batches(path, BATCH_LINES, start))
+
+    pending = deque()
+
+    for end, func, task in tasks:
+        pending.append((end, pool.apply_async(func, (task,))))
+
+        if len(pending) >= 2 * workers:
+            end, result = pending.popleft()
+            yield (end,) + result.get()
+
+    while pending:
+        end, result = pending.popleft()
+        yield (end,) + result.get()
+
+
+def main(timeframes, workers=1, batch_size=1000, profile='safe', resume=False):
     # Base Directory
     BASE_DIR = get_base_dir()
 
     # Check if some directories exist or not
-    try:
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'logs'))
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'raw'))
-        os.makedirs(os.path.join(BASE_DIR, 'data', 'processed'))
-    except OSError as e:
-        if e.errno != errno.EEXIST:
-            raise e
-        else:
-            pass
+    for directory in ('logs', 'raw', 'processed'):
+        try:
+            os.makedirs(os.path.join(BASE_DIR, 'data', directory))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+            else:
+                pass
+
+    # Group the timeframes by year, since all the timeframes of a year are written to the same database.
+    years = {}
+    for timeframe in timeframes:
+        years.setdefault(timeframe.split('-')[0], []).append(timeframe)
+
+    # Pool of parse workers; the rows are parsed in this process when running with a single worker.
+    pool = Pool(workers) if workers > 1 else None
 
     try:
         # Logs
-        log = open(
-            os.path.join(BASE_DIR, 'data', 'logs', 'dirty_{}.txt'.format(str(time.time()).split('.')[0])),
-            mode='a'
-        )
+        log = open_log('dirty')
 
-        for timeframe in timeframes:
+        for year, year_timeframes in years.items():
             # Database connection.
             conn = sqlite3.connect(
                 'file:{}?mode=rwc'.format(
-                    os.path.join(BASE_DIR, 'data', 'processed', 'RC_dirty_{}.db'.format(timeframe.split('-')[0]))
+                    os.path.join(BASE_DIR, 'data', 'processed', 'RC_dirty_{}.db'.format(year))
                 ),
                 uri=True
             )
+            conn = apply_profile(conn, profile)
             cur = conn.cursor()
 
-            cur = create_tables(cur)
-
-            # Open the reddit comments file.
-            with open(os.path.join(BASE_DIR, 'data', 'raw', 'RC_{}'.format(timeframe)), buffering=10000000) as data:
-                print('Beginning to write comments of {} to the database. Time: {}\n'.format(timeframe, str(datetime.now())))
-                log.write('Beginning to write comments of {} to the database. Time: {}\n\n'.format(timeframe, str(datetime.now())))
-                # Insert all comments to the database.
-                for row in data:
-                    row_counter += 1
-
-                    # Load the data row as JSON.
-                    row = json.loads(row)
-
-                    # Required data.
-                    parent_id = row['parent_id']
-                    comment = reformat(row['body'])
-                    created_unix = row['created_utc']
-                    score = row['score']
-                    comment_id = row['id']
-                    subreddit = row['subreddit']
-
-                    if parent_id.split('_')[0] == 't3':
-                        if acceptable(comment):
-                            conn, cur = insert_to_table(
-                                conn,
-                                cur,
-                                comment=comment,
-                                created_unix=created_unix,
-                                comment_id=comment_id,
-                                subreddit=subreddit,
-                                score=score
-                            )
-
-                    if row_counter % 10000 == 0:
-                        print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
-                        log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
+            # Bulk loads create new tables without primary keys and build all the indexes after the load.
+            cur = create_tables(cur, keyed=(profile != 'bulk'))
+            cur = create_checkpoint_table(cur)
+            conn.commit()
 
-            log.write('\nDone writing comments of {} to the database\n\n'.format(timeframe))
+            # Whether any data has been loaded into the database of the year by this run.
+            loaded = False
 
-            # Insert replies for the comments.
-            with open(os.path.join(BASE_DIR, 'data', 'raw', 'RC_{}'.format(timeframe)), buffering=10000000) as data:
+            for timeframe in year_timeframes:
                 row_counter = 0
+                offset = 0
+
+                # Find the reddit comments file, which may be compressed.
+                try:
+                    path = find_dump(os.path.join(BASE_DIR, 'data', 'raw'), timeframe)
+                except FileNotFoundError:
+                    print('Error: RC_{} does not exist in data/raw.'.format(timeframe))
+                    exit(errno.ENOENT)
+
+                dump_size = os.path.getsize(path)
+
+                if resume:
+                    checkpoint = get_checkpoint(cur, timeframe)
+
+                    if checkpoint is not None:
+                        if checkpoint[0] != dump_size:
+                            print('Error: RC_{} has changed since it was last ingested. Run "createdirtydb" without --resume.'.format(timeframe))
+                            exit(errno.EINVAL)
+
+                        if checkpoint[3]:
+                            print('Skipping {}, it has already been ingested.\n'.format(timeframe))
+                            log.write('Skipping {}, it has already been ingested.\n\n'.format(timeframe))
+                            continue
+
+                        offset, row_counter = checkpoint[1], checkpoint[2]
+
+                        print('Resuming {} from byte {} after {} rows.'.format(timeframe, offset, row_counter))
+                        log.write('Resuming {} from byte {} after {} rows.\n'.format(timeframe, offset, row_counter))
+
+                if profile == 'bulk' and not loaded:
+                    cur = drop_indexes(cur)
+                loaded = True
+
+                # Comments and replies are written in a single pass over the file.
+                print('Beginning to write comments and replies of {} to the database. Time: {}\n'.format(timeframe, str(datetime.now())))
+                log.write('Beginning to write comments and replies of {} to the database. Time: {}\n\n'.format(timeframe, str(datetime.now())))
+
+                telemetry = StageTelemetry('createdirtydb', timeframe)
+
+                # Rows are only committed together with the checkpoint of the batch of the dump they
+                # were parsed from, so a resumed load continues exactly after the last committed row.
+                with telemetry, TransactionBuilder(conn, batch_size, autoflush=False) as builder:
+                    for end, lines_parsed, rows, rejected in parse_dump(path, pool, workers, offset):
+                        for row in rows:
+                            insert_row(builder, row)
+
+                        telemetry.read(lines_parsed, end - offset)
+                        telemetry.accept(len(rows))
+                        telemetry.reject_all(rejected)
+                        telemetry.progress()
+
+                        offset = end
+                        row_counter += lines_parsed
+                        builder.checkpoint(SAVE_CHECKPOINT, (timeframe, dump_size, offset, row_counter, 0))
 
-                print('Beginning to write replies of {} to the database. Time: {}'.format(timeframe, str(datetime.now())))
-                log.write('\nBeginning to write replies of {} to the database. Time: {}\n\n'.format(timeframe, str(datetime.now())))
-
-                for row in data:
-                    row_counter += 1
-
-                    # Load the data row as JSON.
-                    row = json.loads(row)
-
-                    # Required data.
-                    parent_id = row['parent_id']
-                    comment = reformat(row['body'])
-                    created_unix = row['created_utc']
-                    score = row['score']
-                    comment_id = row['id']
-                    subreddit = row['subreddit']
-
-                    if parent_id.split('_')[0] == 't1':
-                        if acceptable(comment):
-                            conn, cur = insert_to_table(
-                                conn,
-                                cur,
-                                has_parent=True,
-                                parent_id=parent_id.split('_')[1],
-                                comment=comment,
-                                created_unix=created_unix,
-                                comment_id=comment_id,
-                                subreddit=subreddit,
-                                score=score
-                            )
-
-                    if row_counter % 10000 == 0:
                         print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
                         log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
-            
-            log.write('\nDone writing replies of {} to the database\n\n'.format(timeframe))
 
-            # Print and log finishing statements.
-            print('Finishing entering data to the database. Time: {}'.format(str(datetime.now())))
-            log.write('\nFinishing entering data to the database. Time: {}\n'.format(str(datetime.now())))
-            log.write('===========================================================================\n\n')
+                    builder.flush()
+
+                    # Rows refused by the primary keys, i.e. comments already in the database.
+                    telemetry.reject(DUPLICATE, builder.failed, accepted=True)
+
+                cur.execute(SAVE_CHECKPOINT, (timeframe, dump_size, offset, row_counter, 1))
+                conn.commit()
+
+                print('Rows inserted: {}. Rows rejected by the database: {}.'.format(builder.inserted, builder.failed))
+                log.write('\nRows inserted: {}. Rows rejected by the database: {}.\n'.format(builder.inserted, builder.failed))
+
+                log.write('\nDone writing comments and replies of {} to the database\n\n'.format(timeframe))
+
+            print('Building indexes of RC_dirty_{}.db. Time: {}'.format(year, str(datetime.now())))
+            log.write('Building indexes of RC_dirty_{}.db. Time: {}\n'.format(year, str(datetime.now())))
+
+            if profile == 'bulk':
+                cur, removed = create_keys(cur)
+
+                print('Duplicate rows removed: {}.'.format(removed))
+                log.write('Duplicate rows removed: {}.\n'.format(removed))
+
+            cur = create_indexes(cur)
+            conn.commit()
+
+            if profile == 'bulk' and loaded:
+                print('Compacting RC_dirty_{}.db. Time: {}'.format(year, str(datetime.now())))
+                log.write('Compacting RC_dirty_{}.db. Time: {}\n'.format(year, str(datetime.now())))
+
+                conn = finish_profile(conn, profile)
+
+            cur.close()
+            conn.close()
+
+        # Print and log finishing statements.
+        print('Finishing entering data to the database. Time: {}'.format(str(datetime.now())))
+        log.write('\nFinishing entering data to the database. Time: {}\n'.format(str(datetime.now())))
+        log.write('===========================================================================\n\n')
     except Exception as e:
         raise e
+    finally:
+        if pool is not None:
+            pool.terminate()
 
     log.close()
-    cur.close()
-    conn.close()
@@ -0,0 +1,279 @@
+from __future__ import absolute_import
+
+import os
+import errno
+import sqlite3
+import tempfile
+from datetime import datetime
+from multiprocessing import Pool
+
+from poncho.utils.get_base_dir import get_base_dir
+from poncho.utils.open_log import open_log
+from poncho.utils.read_dump import find_dump
+from poncho.utils.shuffle import ROW_OVERHEAD, shuffle_rows
+from poncho.utils.dedup import create_deduplicator
+from poncho.utils.telemetry import StageTelemetry
+from poncho.preprocess.dirty_populate import parse_dump
+from poncho.postprocess.prepare_data import get_new_data_dir, DatasetWriter
+
+
+# Default memory available for the comments and replies of a year, in bytes.
+MEMORY_BUDGET = 1 << 30
+
+# Statements of the spill database. Like the primary key of rc_comment, the first comment seen with
+# an ID is kept; a reply only replaces the best reply to its parent if its score is higher.
+SPILL_COMMENT = '''
+INSERT OR IGNORE INTO parents (comment_id, comment)
+VALUES (?, ?)
+'''
+SPILL_REPLY = '''
+INSERT OR REPLACE INTO best (parent_id, score, reply)
+SELECT ?, ?, ?
+WHERE NOT EXISTS (SELECT 1 FROM best WHERE parent_id = ? AND score >= ?)
+'''
+
+
+class BestReplyIndex(object):
+    '''Track the comments of a dump and the best reply to each of them as the rows are read, so that
+    the pairs built by "cleanupdb" and "preparedata" are obtained in a single pass without any
+    intermediate database. Comments with a negative score are remembered without their text, since
+    they are never paired. Once the rows held in memory exceed 'memory_budget', they are merged into
+    a temporary SQLite database and the pairs are joined there at the end.
+
+    Unlike rc_reply, replies are not checked for duplicate IDs, which would require remembering the
+    ID of every reply; the IDs in the dumps of a year are expected to be unique.
+
+    Args:
+        memory_budget -> Default: MEMORY_BUDGET. Memory available for the rows, in bytes.
+    '''
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+
+        # comment_id -> comment, or None if the score of the comment is negative.
+        self.parents = {}
+        # parent_id -> (score, reply) of the best reply seen to the parent.
+        self.best = {}
+
+        # Estimated memory used by the rows held in memory, and by all the rows seen.
+        self.size = 0
+        self.total_size = 0
+
+        self.spill_dir = None
+        self.conn = None
+        self.spills = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_comment(self, comment_id, score, comment):
+        '''Add a comment that is not a reply to another comment.
+
+        Args:
+            comment_id -> ID of the comment.
+            score -> Score of the comment.
+            comment -> Body of the comment.
+        '''
+        if comment_id in self.parents:
+            return
+
+        if score >= 0:
+            self.parents[comment_id] = comment
+            self.grow(ROW_OVERHEAD + len(comment))
+        else:
+            self.parents[comment_id] = None
+            self.grow(ROW_OVERHEAD)
+
+    def add_reply(self, parent_id, score, reply):
+        '''Add a reply to a comment, which may be seen before or after the comment itself.
+
+        Args:
+            parent_id -> ID of the comment replied to.
+            score -> Score of the reply.
+            reply -> Body of the reply.
+        '''
+        best = self.best.get(parent_id)
+
+        if best is None or score > best[0]:
+            self.best[parent_id] = (score, reply)
+            self.grow(ROW_OVERHEAD + len(reply))
+
+    def grow(self, size):
+        '''Account for a row added to memory, spilling the rows to disk if they exceed the budget.
+
+        Args:
+            size -> Estimated memory used by the row.
+        '''
+        self.size += size
+        self.total_size += size
+
+        if self.size > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        '''Merge the rows held in memory into the spill database and clear them.'''
+        if self.conn is None:
+            self.spill_dir = tempfile.TemporaryDirectory()
+            self.conn = sqlite3.connect(os.path.join(self.spill_dir.name, 'spill.db'))
+            self.conn.execute('PRAGMA journal_mode = OFF')
+            self.conn.execute('PRAGMA synchronous = OFF')
+            self.conn.execute('CREATE TABLE parents (comment_id TEXT PRIMARY KEY, comment TEXT)')
+            self.conn.execute('CREATE TABLE best (parent_id TEXT PRIMARY KEY, score INT, reply TEXT)')
+
+        self.conn.executemany(SPILL_COMMENT, self.parents.items())
+        self.conn.executemany(
+            SPILL_REPLY,
+            ((parent_id, score, reply, parent_id, score) for parent_id, (score, reply) in self.best.items())
+        )
+        self.conn.commit()
+
+        self.parents = {}
+        self.best = {}
+        self.size = 0
+        self.spills += 1
+
+    def pairs(self):
+        '''Iterate over every comment with a score of at least 0 that has a reply, along with its
+        best reply. Must only be called once all the rows have been added.
+
+        Yields:
+            Tuples of (comment, reply).
+        '''
+        if self.conn is None:
+            for parent_id, (_, reply) in self.best.items():
+                comment = self.parents.get(parent_id)
+
+                if comment is not None:
+                    yield comment, reply
+            return
+
+        self.spill()
+
+        cur = self.conn.execute('''
+        SELECT parents.comment, best.reply
+        FROM best JOIN parents ON parents.comment_id = best.parent_id
+        WHERE parents.comment IS NOT NULL
+        ''')
+
+        for row in cur:
+            yield row
+
+    def close(self):
+        '''Release the rows and remove the spill database.'''
+        self.parents = {}
+        self.best = {}
+
+        if self.conn is not None:
+            self.conn.close()
+            self.spill_dir.cleanup()
+            self.conn = None
+
+
+def main(timeframes, workers=1, memory_budget=MEMORY_BUDGET, seed=None, dev_fraction=0.0, test_fraction=0.0,
+         dedup=False, max_repeats=None, near_threshold=None):
+    # Base Directory
+    BASE_DIR = get_base_dir()
+
+    # Check if some directories exist or not
+    for directory in ('logs', 'raw'):
+        try:
+            os.makedirs(os.path.join(BASE_DIR, 'data', directory))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+            else:
+                pass
+
+    # Group the timeframes by year, since comments are only paired with replies of the same year.
+    years = {}
+    for timeframe in timeframes:
+        years.setdefault(timeframe.split('-')[0], []).append(timeframe)
+
+    # Pool of parse workers; the rows are parsed in this process when running with a single worker.
+    pool = Pool(workers) if workers > 1 else None
+
+    try:
+        log = open_log('fused')
+
+        log.write('Beginning to create the training dataset from the dumps. Time: {}\n\n'.format(str(datetime.now())))
+        print('Beginning to create the training dataset from the dumps. Time: {}\n'.format(str(datetime.now())))
+
+        with DatasetWriter(get_new_data_dir(), dev_fraction, test_fraction, seed) as writer:
+            for year in sorted(years):
+                with BestReplyIndex(memory_budget) as index:
+                    for timeframe in years[year]:
+                        row_counter = 0
+
+                        # Find the reddit comments file, which may be compressed.
+                        try:
+                            path = find_dump(os.path.join(BASE_DIR, 'data', 'raw'), timeframe)
+                        except FileNotFoundError:
+                            print('Error: RC_{} does not exist in data/raw.'.format(timeframe))
+                            exit(errno.ENOENT)
+
+                        print('Reading comments and replies of {}. Time: {}\n'.format(timeframe, str(datetime.now())))
+                        log.write('Reading comments and replies of {}. Time: {}\n\n'.format(timeframe, str(datetime.now())))
+
+                        offset = 0
+
+                        with StageTelemetry('fusedtraindata', timeframe) as telemetry:
+                            for end, lines_parsed, rows, rejected in parse_dump(path, pool, workers):
+                                for parent_id, comment_id, _, score, comment, _ in rows:
+                                    if parent_id is None:
+                                        index.add_comment(comment_id, score, comment)
+                                    else:
+                                        index.add_reply(parent_id, score, comment)
+
+                                telemetry.read(lines_parsed, end - offset)
+                                telemetry.accept(len(rows))
+                                telemetry.reject_all(rejected)
+                                telemetry.progress()
+
+                                offset = end
+                                row_counter += lines_parsed
+
+                                print('No. of rows processed: {}. Time: {}'.format(row_counter, str(datetime.now())))
+                                log.write('No. of rows processed: {}. Time: {}\n'.format(row_counter, str(datetime.now())))
+
+                    print('Writing the pairs of {}. Times spilled to disk: {}. Time: {}'.format(year, index.spills, str(datetime.now())))
+                    log.write('Writing the pairs of {}. Times spilled to disk: {}. Time: {}\n'.format(year, index.spills, str(datetime.now())))
+
+                    pairs = index.pairs()
+
+                    deduplicator = create_deduplicator(dedup, max_repeats, near_threshold)
+                    if deduplicator is not None:
+                        pairs = (pair for pair in pairs if deduplicator.keep(*pair))
+
+                    # The pairs of the year are recorded under the year, the rows of the dumps under their timeframe.
+                    with StageTelemetry('fusedtraindata', year) as telemetry:
+                        written = sum(writer.counts.values())
+
+                        # The size of all the rows seen bounds the size of the pairs.
+                        for comment, reply in shuffle_rows(pairs, index.total_size, memory_budget, seed):
+                            writer.write(comment, reply)
+
+                        telemetry.accept(sum(writer.counts.values()) - written)
+                        if deduplicator is not None:
+                            telemetry.reject_all(deduplicator.removed)
+                        telemetry.read(telemetry.rows_accepted + telemetry.rows_rejected)
+
+                    if deduplicator is not None:
+                        print(deduplicator.report())
+                        log.write(deduplicator.report() + '\n')
+
+        for dataset in writer.datasets:
+            print('Pairs written to {}: {}.'.format(dataset, writer.counts[dataset]))
+            log.write('Pairs written to {}: {}.\n'.format(dataset, writer.counts[dataset]))
+
+        print('Finishing up... Time: {}'.format(str(datetime.now())))
+        log.write('\nFinishing up... Time: {}\n'.format(str(datetime.now())))
+        log.write('===========================================================================\n\n')
+    except Exception as e:
+        raise e
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+    log.close()
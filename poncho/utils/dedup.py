@@ -0,0 +1,251 @@
+import re
+import hashlib
+from collections import Counter
+from operator import eq
+
+
+# Characters that are ignored when comparing texts, including the escape sequences added by reformat.
+IGNORED = re.compile(r'<NL>|<CR>|<TAB>|[\W_]+')
+
+# Reasons for which a pair is removed.
+DUPLICATE = 'duplicate pair'
+NEAR_DUPLICATE = 'near duplicate pair'
+FREQUENT_COMMENT = 'frequent comment'
+FREQUENT_REPLY = 'frequent reply'
+
+
+def normalize(text):
+    '''Normalize a text so that texts differing only in case, punctuation or spacing are equal.
+
+    Args:
+        text -> Text to be normalized.
+    Returns:
+        Normalized text.
+    '''
+    return ' '.join(IGNORED.sub(' ', text.lower()).split())
+
+
+def fingerprint(text):
+    '''Get a 64 bit fingerprint of a normalized text.
+
+    Args:
+        text -> Normalized text.
+    Returns:
+        Fingerprint as an integer.
+    '''
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def shingles(text, size=3):
+    '''Get the fingerprints of the word shingles of a normalized text.
+
+    Args:
+        text -> Normalized text.
+        size -> Default: 3. Number of words in every shingle.
+    Returns:
+        Set of fingerprints. Texts shorter than a shingle give the fingerprint of the whole text.
+    '''
+    words = text.split(' ')
+
+    if len(words) <= size:
+        return {fingerprint(text)}
+
+    return {fingerprint(' '.join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+class MinHash(object):
+    '''Compute MinHash signatures of sets of fingerprints. The fraction of equal values in the
+    signatures of two sets estimates the Jaccard similarity of the sets. A single hash function is
+    used: every fingerprint is assigned to one of 'num_perm' bins, which keep their minimum, and
+    empty bins take the value of the next non-empty bin. This costs one operation per fingerprint
+    instead of one per fingerprint and value.
+
+    Args:
+        num_perm -> Default: 64. Number of values in every signature.
+    '''
+    def __init__(self, num_perm=64):
+        self.num_perm = num_perm
+
+    def signature(self, hashes):
+        '''Compute the signature of a set of fingerprints.
+
+        Args:
+            hashes -> Non-empty set of fingerprints.
+        Returns:
+            Tuple of num_perm values.
+        '''
+        k = self.num_perm
+        bins = [None] * k
+
+        for h in hashes:
+            i = h % k
+            value = h // k
+
+            if bins[i] is None or value < bins[i]:
+                bins[i] = value
+
+        signature = list(bins)
+
+        for i in range(k):
+            if bins[i] is None:
+                # Borrow from the next non-empty bin, remembering how far it is so that values borrowed
+                # from different distances never match.
+                distance = 1
+                while bins[(i + distance) % k] is None:
+                    distance += 1
+
+                signature[i] = (bins[(i + distance) % k], distance)
+
+        return tuple(signature)
+
+
+def create_deduplicator(dedup=False, max_repeats=None, near_threshold=None):
+    '''Create a Deduplicator from the options of manage.py.
+
+    Args:
+        dedup -> Default: False. Set to True to keep a single copy of identical pairs.
+        max_repeats -> Default: None. See Deduplicator.
+        near_threshold -> Default: None. See Deduplicator.
+    Returns:
+        Deduplicator, or None if no pair would ever be removed.
+    '''
+    if not dedup and max_repeats is None and near_threshold is None:
+        return None
+
+    return Deduplicator(max_pairs=1 if dedup else None, max_repeats=max_repeats, near_threshold=near_threshold)
+
+
+class Deduplicator(object):
+    '''Decide, in a single streaming pass, which comment-reply pairs are kept. Texts are compared
+    after normalization through their 64 bit fingerprints, so only the fingerprints and their
+    counts are held in memory. Pairs may be removed because:
+        - the same pair has already been kept 'max_pairs' times;
+        - the same comment or the same reply has already been kept 'max_repeats' times, as happens
+          with bot replies and copypasta;
+        - with 'near_threshold' set, a kept pair is estimated to have at least this Jaccard
+          similarity with it, from MinHash signatures of word shingles bucketed with LSH.
+    The number of pairs removed for every reason is counted in 'removed'.
+
+    Args:
+        max_pairs -> Default: 1. Number of times the same pair may be kept. No limit if None.
+        max_repeats -> Default: None. Number of times the same comment or the same reply may be kept.
+                       No limit if None.
+        near_threshold -> Default: None. Similarity from which pairs are near duplicates. Near
+                          duplicates are not looked for if None.
+        num_perm -> Default: 64. Number of values in the MinHash signatures.
+        bands -> Default: 16. Number of LSH bands the signatures are split into. Must divide num_perm.
+    '''
+    def __init__(self, max_pairs=1, max_repeats=None, near_threshold=None, num_perm=64, bands=16):
+        if num_perm % bands:
+            raise ValueError('The number of bands must divide the number of permutations.')
+
+        self.max_pairs = max_pairs
+        self.max_repeats = max_repeats
+        self.near_threshold = near_threshold
+
+        self.pairs = Counter()
+        self.comments = Counter()
+        self.replies = Counter()
+
+        self.minhash = MinHash(num_perm) if near_threshold is not None else None
+        self.rows = num_perm // bands
+        # Signatures of the kept pairs, and (band, values of the band) -> indexes of the signatures
+        # having these values.
+        self.signatures = []
+        self.buckets = {}
+
+        self.kept = 0
+        self.removed = Counter()
+
+    def check(self, comment, reply):
+        '''Decide whether a pair is kept, and record it if it is.
+
+        Args:
+            comment -> Comment of the pair.
+            reply -> Reply to the comment.
+        Returns:
+            None if the pair is kept, the reason for removing it otherwise.
+        '''
+        comment = normalize(comment)
+        reply = normalize(reply)
+
+        comment_key = fingerprint(comment)
+        reply_key = fingerprint(reply)
+        pair_key = (comment_key, reply_key)
+
+        if self.max_pairs is not None and self.pairs[pair_key] >= self.max_pairs:
+            return DUPLICATE
+
+        if self.max_repeats is not None:
+            if self.comments[comment_key] >= self.max_repeats:
+                return FREQUENT_COMMENT
+            if self.replies[reply_key] >= self.max_repeats:
+                return FREQUENT_REPLY
+
+        if self.minhash is not None:
+            signature = self.minhash.signature(shingles(comment + ' ' + reply))
+            bands = [
+                (band, signature[band * self.rows:(band + 1) * self.rows])
+                for band in range(len(signature) // self.rows)
+            ]
+
+            # Pairs that are kept several times are not near duplicates of their own copies.
+            if not self.pairs[pair_key] and self.is_near_duplicate(signature, bands):
+                return NEAR_DUPLICATE
+
+            for band in bands:
+                self.buckets.setdefault(band, []).append(len(self.signatures))
+            self.signatures.append(signature)
+
+        self.pairs[pair_key] += 1
+        self.comments[comment_key] += 1
+        self.replies[reply_key] += 1
+        self.kept += 1
+
+        return None
+
+    def is_near_duplicate(self, signature, bands):
+        '''Check if a kept pair sharing an LSH bucket with a signature is similar enough to it.
+
+        Args:
+            signature -> Signature of the pair.
+            bands -> Keys of the buckets of the pair.
+        Returns:
+            True if the pair is a near duplicate.
+        '''
+        candidates = set()
+        for band in bands:
+            candidates.update(self.buckets.get(band, ()))
+
+        for candidate in candidates:
+            if sum(map(eq, signature, self.signatures[candidate])) >= self.near_threshold * len(signature):
+                return True
+
+        return False
+
+    def keep(self, comment, reply):
+        '''Decide whether a pair is kept, counting the reason if it is removed.
+
+        Args:
+            comment -> Comment of the pair.
+            reply -> Reply to the comment.
+        Returns:
+            True if the pair is kept.
+        '''
+        reason = self.check(comment, reply)
+
+        if reason is None:
+            return True
+
+        self.removed[reason] += 1
+        return False
+
+    def report(self):
+        '''Describe the number of pairs kept and removed.
+
+        Returns:
+            String describing the counts.
+        '''
+        removed = ', '.join('{}: {}'.format(reason, count) for reason, count in sorted(self.removed.items()))
+
+        return 'Pairs kept: {}. Pairs removed: {}.'.format(self.kept, removed or 0)
@@ -1,8 +1,14 @@
 import os
 
 
+# Environment variable overriding the base directory, e.g. to run the pipeline on benchmark data
+# without touching the real 'data' directory.
+BASE_DIR_VARIABLE = 'PONCHO_BASE_DIR'
+
+
 def get_base_dir():
-    '''Utility function to get the base directory of the project.
+    '''Utility function to get the base directory of the project. It can be overridden with the
+    PONCHO_BASE_DIR environment variable.
 
     Returns:
         String containing the base directory of the project.
@@ -10,4 +16,7 @@ def get_base_dir():
     Usage:
         Use os.path.join(BASE_DIR, ...) to get absolute path to the specified directory.
     '''
+    if os.environ.get(BASE_DIR_VARIABLE):
+        return os.path.abspath(os.environ[BASE_DIR_VARIABLE])
+
     return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
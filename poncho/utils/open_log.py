@@ -0,0 +1,58 @@
+import os
+import time
+import errno
+
+from poncho.utils.get_base_dir import get_base_dir
+
+
+# Tag added to the names of the log files opened by this process. Set for the jobs run in parallel
+# by manage.py, so that every job writes its own log files.
+LOG_TAG = None
+
+
+def set_log_tag(tag):
+    '''Set the tag added to the names of the log files opened by this process.
+
+    Args:
+        tag -> Tag to be added, e.g. the year processed by a job. None to remove the tag.
+    '''
+    global LOG_TAG
+
+    LOG_TAG = tag
+
+
+def log_path(name, extension='.txt'):
+    '''Get the path of a new log file in the 'data/logs' directory.
+
+    Args:
+        name -> Name of the log, e.g. the stage writing it.
+        extension -> Default: '.txt'. Extension of the file.
+    Returns:
+        Path to the log file, named after the log, the tag of this process and the current time.
+    '''
+    if LOG_TAG is None:
+        file_name = '{}_{}{}'.format(name, str(time.time()).split('.')[0], extension)
+    else:
+        file_name = '{}_{}_{}{}'.format(name, LOG_TAG, str(time.time()).split('.')[0], extension)
+
+    return os.path.join(get_base_dir(), 'data', 'logs', file_name)
+
+
+def open_log(name):
+    '''Open a new log file in the 'data/logs' directory for appending, creating the directory if
+    required.
+
+    Args:
+        name -> Name of the log, e.g. the stage writing it.
+    Returns:
+        File object of the log.
+    '''
+    path = log_path(name)
+
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise e
+
+    return open(path, mode='a')
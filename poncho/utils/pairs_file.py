@@ -0,0 +1,248 @@
+import os
+import json
+import mmap
+import struct
+import zlib
+from array import array
+
+
+# Layout of a pairs file:
+#   MAGIC
+#   Blocks of up to 'block_rows' rows. Every column of a block is stored separately, compressed with
+#   zlib: integer columns as an array of 64 bit integers, text columns as an array of the lengths of
+#   the UTF-8 encoded values followed by the concatenated values. Arrays are in native byte order.
+#   Footer: JSON index giving the columns and, for every block, its number of rows and the offset
+#   and size of each of its columns.
+#   Size of the footer as a 64 bit little endian integer, then MAGIC again.
+# A column can therefore be read without reading or decompressing the other columns.
+MAGIC = b'PONCHOP1'
+TRAILER = struct.Struct('<Q')
+
+# Types of the columns.
+TYPES = ('int', 'str')
+
+# Default number of rows in a block.
+BLOCK_ROWS = 65536
+
+# Extension of pairs files.
+EXTENSION = '.pairs'
+
+
+def encode_column(values, type_):
+    '''Encode and compress the values of a column of a block.
+
+    Args:
+        values -> Values of the column.
+        type_ -> One of TYPES.
+    Returns:
+        Compressed column as bytes.
+    '''
+    if type_ == 'int':
+        data = array('q', values).tobytes()
+    else:
+        encoded = [value.encode('utf-8') for value in values]
+        data = array('Q', map(len, encoded)).tobytes() + b''.join(encoded)
+
+    return zlib.compress(data, 6)
+
+
+def decode_column(data, type_, rows):
+    '''Decompress and decode a column of a block.
+
+    Args:
+        data -> Compressed column.
+        type_ -> One of TYPES.
+        rows -> Number of rows in the block.
+    Returns:
+        List of the values of the column.
+    '''
+    data = zlib.decompress(data)
+
+    if type_ == 'int':
+        return array('q', data).tolist()
+
+    lengths = array('Q', data[:8 * rows])
+    values = []
+    offset = 8 * rows
+
+    for length in lengths:
+        values.append(data[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    return values
+
+
+class PairsWriter(object):
+    '''Write rows to a pairs file. The file is written under a temporary name and renamed once it is
+    closed, so it is replaced as a whole and never left half written.
+
+    Usage:
+        with PairsWriter(path, (('id', 'int'), ('comment', 'str'), ('reply', 'str'))) as writer:
+            writer.write(row)
+
+    Args:
+        path -> Path to the file.
+        columns -> Sequence of (name, type) tuples describing the columns of the rows.
+        block_rows -> Default: BLOCK_ROWS. Number of rows in every block.
+    '''
+    def __init__(self, path, columns, block_rows=BLOCK_ROWS):
+        for name, type_ in columns:
+            if type_ not in TYPES:
+                raise ValueError('Unknown type of column {}: {}'.format(name, type_))
+
+        self.path = path
+        self.columns = list(columns)
+        self.block_rows = block_rows
+
+        self.f = open(path + '.tmp', mode='wb')
+        self.f.write(MAGIC)
+
+        # Values of every column for the block being built.
+        self.block = [[] for _ in self.columns]
+        self.blocks = []
+        self.rows = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.f.close()
+            os.remove(self.f.name)
+
+    def write(self, row):
+        '''Add a row to the file.
+
+        Args:
+            row -> Sequence with a value for every column.
+        '''
+        for values, value in zip(self.block, row):
+            values.append(value)
+
+        self.rows += 1
+
+        if len(self.block[0]) >= self.block_rows:
+            self.flush()
+
+    def flush(self):
+        '''Write the block being built to the file.'''
+        rows = len(self.block[0])
+
+        if not rows:
+            return
+
+        offsets = {}
+
+        for (name, type_), values in zip(self.columns, self.block):
+            data = encode_column(values, type_)
+            offsets[name] = (self.f.tell(), len(data))
+            self.f.write(data)
+
+        self.blocks.append({'rows': rows, 'columns': offsets})
+        self.block = [[] for _ in self.columns]
+
+    def close(self):
+        '''Write the remaining rows and the footer, and move the file to its final name.'''
+        self.flush()
+
+        footer = json.dumps({'columns': self.columns, 'rows': self.rows, 'blocks': self.blocks}).encode('utf-8')
+        self.f.write(footer)
+        self.f.write(TRAILER.pack(len(footer)))
+        self.f.write(MAGIC)
+        self.f.close()
+
+        os.replace(self.f.name, self.path)
+
+
+class PairsReader(object):
+    '''Read a pairs file. The file is memory-mapped and only the blocks of the requested columns are
+    decompressed.
+
+    Usage:
+        with PairsReader(path) as reader:
+            for comment, reply in reader.read(('comment', 'reply')):
+                ...
+
+    Args:
+        path -> Path to the file.
+    Raises:
+        ValueError if the file is not a pairs file.
+    '''
+    def __init__(self, path):
+        self.f = open(path, mode='rb')
+
+        try:
+            self.map = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped.
+            self.f.close()
+            raise ValueError('{} is not a pairs file.'.format(path))
+
+        end = len(self.map) - len(MAGIC)
+        if self.map[:len(MAGIC)] != MAGIC or self.map[end:] != MAGIC:
+            self.close()
+            raise ValueError('{} is not a pairs file.'.format(path))
+
+        size, = TRAILER.unpack(self.map[end - TRAILER.size:end])
+        footer = json.loads(self.map[end - TRAILER.size - size:end - TRAILER.size].decode('utf-8'))
+
+        self.columns = [tuple(column) for column in footer['columns']]
+        self.types = dict(self.columns)
+        self.rows = footer['rows']
+        self.blocks = footer['blocks']
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.rows
+
+    def read_blocks(self, columns=None):
+        '''Iterate over the blocks of the file, column by column.
+
+        Args:
+            columns -> Default: None. Names of the columns to be read. All the columns if None.
+        Raises:
+            KeyError if a column does not exist.
+        Yields:
+            List with the list of values of every requested column, for every block.
+        '''
+        if columns is None:
+            columns = [name for name, _ in self.columns]
+
+        for name in columns:
+            if name not in self.types:
+                raise KeyError('Unknown column: {}'.format(name))
+
+        for block in self.blocks:
+            values = []
+
+            for name in columns:
+                offset, size = block['columns'][name]
+                values.append(decode_column(self.map[offset:offset + size], self.types[name], block['rows']))
+
+            yield values
+
+    def read(self, columns=None):
+        '''Iterate over the rows of the file.
+
+        Args:
+            columns -> Default: None. Names of the columns to be read. All the columns if None.
+        Raises:
+            KeyError if a column does not exist.
+        Yields:
+            Tuples with the values of the requested columns.
+        '''
+        for values in self.read_blocks(columns):
+            for row in zip(*values):
+                yield row
+
+    def close(self):
+        '''Unmap and close the file.'''
+        self.map.close()
+        self.f.close()
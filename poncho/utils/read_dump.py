@@ -0,0 +1,272 @@
+import bz2
+import io
+import lzma
+import os
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Extensions that are tried, in order, when looking for the dump of a timeframe.
+EXTENSIONS = ('', '.bz2', '.xz', '.zst')
+
+# Magic bytes at the start of each supported compressed file.
+MAGIC = (
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zst'),
+)
+
+# Size of the decompressed chunks handed over by the reader thread.
+CHUNK_SIZE = 1 << 22
+# Maximum number of chunks that may be waiting to be parsed.
+QUEUE_SIZE = 16
+
+
+def find_dump(raw_dir, timeframe):
+    '''Find the Reddit comments dump of a timeframe. The dump may be stored as it is or
+    compressed as downloaded from pushshift.
+
+    Args:
+        raw_dir -> Directory containing the dumps.
+        timeframe -> Timeframe of the dump.
+    Raises:
+        FileNotFoundError if no dump exists for the timeframe.
+    Returns:
+        Path to the dump.
+    '''
+    for extension in EXTENSIONS:
+        path = os.path.join(raw_dir, 'RC_{}{}'.format(timeframe, extension))
+
+        if os.path.isfile(path):
+            return path
+
+    raise FileNotFoundError('No dump found for {} in {}'.format(timeframe, raw_dir))
+
+
+def detect_compression(path):
+    '''Detect the compression format of a file from its magic bytes.
+
+    Args:
+        path -> Path to the file.
+    Returns:
+        'bz2', 'xz' or 'zst' for compressed files, None otherwise.
+    '''
+    with open(path, mode='rb') as f:
+        head = f.read(6)
+
+    for magic, compression in MAGIC:
+        if head.startswith(magic):
+            return compression
+
+    return None
+
+
+def open_dump(path):
+    '''Open a dump for reading, transparently decompressing it if required.
+
+    Args:
+        path -> Path to the dump.
+    Raises:
+        ImportError if the dump is compressed with zstandard and the module is not installed.
+    Returns:
+        Binary file object returning the decompressed contents of the dump.
+    '''
+    compression = detect_compression(path)
+
+    if compression == 'bz2':
+        return bz2.open(path, mode='rb')
+    elif compression == 'xz':
+        return lzma.open(path, mode='rb')
+    elif compression == 'zst':
+        if zstandard is None:
+            raise ImportError('Reading {} requires the "zstandard" module.'.format(path))
+
+        # Pushshift archives are compressed with a long window.
+        decompressor = zstandard.ZstdDecompressor(max_window_size=1 << 31)
+        return decompressor.stream_reader(open(path, mode='rb'), read_size=CHUNK_SIZE, closefd=True)
+    else:
+        return open(path, mode='rb', buffering=CHUNK_SIZE)
+
+
+def skip_dump(f, start):
+    '''Move a dump opened by open_dump forward to a byte offset of its decompressed contents.
+    Uncompressed dumps are seeked, compressed ones are decompressed up to the offset.
+
+    Args:
+        f -> File object returned by open_dump.
+        start -> Offset to be moved to.
+    '''
+    if isinstance(f, io.BufferedReader):
+        f.seek(start)
+        return
+
+    while start > 0:
+        skipped = len(f.read(min(start, CHUNK_SIZE)))
+
+        if not skipped:
+            break
+
+        start -= skipped
+
+
+def _reader(path, start, chunks, stop):
+    '''Read decompressed chunks of a dump and push them to a queue. Runs in a background thread.
+    The end of the dump is marked by pushing None, errors are pushed to be raised by the consumer.
+
+    Args:
+        path -> Path to the dump.
+        start -> Offset of the decompressed contents at which reading starts.
+        chunks -> Queue receiving the chunks.
+        stop -> Event set by the consumer when it stops reading.
+    '''
+    try:
+        with open_dump(path) as f:
+            skip_dump(f, start)
+
+            while not stop.is_set():
+                chunk = f.read(CHUNK_SIZE)
+
+                if not chunk:
+                    break
+
+                chunks.put(chunk)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+
+def _read_lines(path, start):
+    '''Iterate over the lines of a dump, a chunk at a time. Reading and decompression are done in a
+    background thread so that they overlap with the processing of the lines.
+
+    Args:
+        path -> Path to the dump.
+        start -> Offset of the decompressed contents at which reading starts. Must be the start of a line.
+    Raises:
+        Any error raised while reading the dump.
+    Yields:
+        Tuples of (lines, terminated) for every chunk. 'lines' are the lines of the chunk as bytes,
+        without the trailing newline, including empty lines so that the offsets of the lines can be
+        computed from their lengths. 'terminated' is False for the last line of a dump not ending
+        with a newline.
+    '''
+    chunks = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+
+    reader = threading.Thread(target=_reader, args=(path, start, chunks, stop), daemon=True)
+    reader.start()
+
+    try:
+        tail = b''
+
+        while True:
+            chunk = chunks.get()
+
+            if chunk is None:
+                break
+            elif isinstance(chunk, Exception):
+                raise chunk
+
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+
+            yield lines, True
+
+        if tail:
+            yield [tail], False
+    finally:
+        # Unblock the reader if the consumer stopped early.
+        stop.set()
+        while reader.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def read_batches(path, size, start=0):
+    '''Iterate over the lines of a dump in batches, along with the offset at which each batch ends,
+    so that reading can later be resumed after any batch.
+
+    Args:
+        path -> Path to the dump.
+        size -> Number of lines in every batch.
+        start -> Default: 0. Offset of the decompressed contents at which reading starts. Must be the
+                 start of a line.
+    Raises:
+        Any error raised while reading the dump.
+    Yields:
+        Tuples of (end, lines) where 'end' is the offset of the decompressed contents following the
+        batch and 'lines' the non-empty lines of the batch as bytes, without the trailing newline.
+    '''
+    offset = start
+    batch = []
+
+    for lines, terminated in _read_lines(path, start):
+        while lines:
+            taken = lines[:size - len(batch)]
+            lines = lines[len(taken):]
+
+            offset += sum(map(len, taken))
+            if terminated:
+                offset += len(taken)
+
+            batch.extend(line for line in taken if line)
+
+            if len(batch) == size:
+                yield offset, batch
+                batch = []
+
+    if batch:
+        yield offset, batch
+
+
+def split_dump(path, size, start=0):
+    '''Split an uncompressed dump into byte ranges that start and end on line boundaries.
+
+    Args:
+        path -> Path to the dump.
+        size -> Approximate size of each range in bytes.
+        start -> Default: 0. Offset at which the first range starts. Must be the start of a line.
+    Yields:
+        Tuples of (start, end) byte offsets.
+    '''
+    total = os.path.getsize(path)
+
+    with open(path, mode='rb') as f:
+
+        while start < total:
+            end = start + size
+
+            if end >= total:
+                end = total
+            else:
+                # Extend the range to the end of the line it stops in.
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+
+            yield start, end
+            start = end
+
+
+def read_range(path, start, end):
+    '''Read the lines of a byte range of an uncompressed dump.
+
+    Args:
+        path -> Path to the dump.
+        start -> Offset of the first byte of the range.
+        end -> Offset of the byte following the range.
+    Returns:
+        List of non-empty lines in the range as bytes, without the trailing newline.
+    '''
+    with open(path, mode='rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    return [line for line in data.split(b'\n') if line]
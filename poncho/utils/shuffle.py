@@ -0,0 +1,75 @@
+import math
+import pickle
+import random
+import tempfile
+
+
+# Approximate memory used by a row held in a Python list, on top of the length of its strings.
+ROW_OVERHEAD = 256
+
+
+def estimate_size(rows, chars):
+    '''Estimate the memory needed to hold rows in a Python list.
+
+    Args:
+        rows -> Number of rows.
+        chars -> Total number of characters in the strings of the rows.
+    Returns:
+        Estimated size in bytes.
+    '''
+    return rows * ROW_OVERHEAD + chars
+
+
+def shuffle_rows(rows, size, memory_budget, seed=None):
+    '''Shuffle rows uniformly at random while holding at most about 'memory_budget' bytes of them in
+    memory. Rows that do not fit are shuffled externally: every row is written to one of several
+    temporary bucket files chosen at random, then each bucket is read back, shuffled in memory and
+    yielded in turn. Assigning rows to buckets uniformly and shuffling every bucket gives a uniform
+    shuffle of all the rows.
+
+    Args:
+        rows -> Iterable over the rows. Rows have to be picklable.
+        size -> Estimated memory needed to hold all the rows, see estimate_size.
+        memory_budget -> Memory available for the rows, in bytes.
+        seed -> Default: None. Seed of the random generator, for reproducible shuffles.
+    Yields:
+        The rows in shuffled order.
+    '''
+    rng = random.Random(seed)
+
+    # Bucket sizes vary around their mean, so leave them room to grow to twice their expected size.
+    buckets = max(1, math.ceil(2 * size / memory_budget))
+
+    if buckets == 1:
+        rows = list(rows)
+        rng.shuffle(rows)
+
+        for row in rows:
+            yield row
+        return
+
+    files = [tempfile.TemporaryFile() for _ in range(buckets)]
+
+    try:
+        for row in rows:
+            pickle.dump(row, files[rng.randrange(buckets)], protocol=pickle.HIGHEST_PROTOCOL)
+
+        for f in files:
+            f.seek(0)
+
+            bucket = []
+            while True:
+                try:
+                    bucket.append(pickle.load(f))
+                except EOFError:
+                    break
+
+            # Release the space of the bucket on disk before yielding its rows.
+            f.close()
+
+            rng.shuffle(bucket)
+            for row in bucket:
+                yield row
+    finally:
+        for f in files:
+            f.close()
@@ -0,0 +1,71 @@
+# Available database profiles.
+#   safe -> SQLite defaults: rollback journal on disk and full sync. A crash never corrupts the database.
+#   bulk -> Journal kept in memory, no syncing, large page cache and memory-mapped I/O. A crash or power
+#           loss during a load may leave the database corrupt, in which case it has to be deleted and
+#           the load run again. The database is returned to the safe settings once the load is done.
+PROFILES = ('safe', 'bulk')
+
+# Settings used by the bulk profile.
+BULK_PAGE_SIZE = 32768
+# Negative values are in KiB.
+BULK_CACHE_SIZE = -1048576
+BULK_MMAP_SIZE = 1 << 30
+# Page cache size of SQLite connections by default, restored once a load is done.
+DEFAULT_CACHE_SIZE = -2000
+
+
+def apply_profile(conn, profile, readonly=False):
+    '''Configure a database connection for the given profile.
+
+    Args:
+        conn -> Database connection.
+        profile -> One of PROFILES.
+        readonly -> Default: False. Set to True for connections that only read from the database;
+                    only the settings speeding up reads are applied to them.
+    Raises:
+        ValueError if the profile does not exist.
+    Returns:
+        Database connection.
+    '''
+    if profile not in PROFILES:
+        raise ValueError('Unknown database profile: {}'.format(profile))
+
+    if profile == 'bulk':
+        conn.execute('PRAGMA cache_size = {}'.format(BULK_CACHE_SIZE))
+        conn.execute('PRAGMA mmap_size = {}'.format(BULK_MMAP_SIZE))
+        conn.execute('PRAGMA temp_store = MEMORY')
+
+        if not readonly:
+            # Only takes effect on new databases; existing ones are converted by the VACUUM in finish_profile.
+            conn.execute('PRAGMA page_size = {}'.format(BULK_PAGE_SIZE))
+            # The journal is still needed to roll back failed batches, so it is kept in memory instead of
+            # being turned off.
+            conn.execute('PRAGMA journal_mode = MEMORY')
+            conn.execute('PRAGMA synchronous = OFF')
+
+    return conn
+
+
+def finish_profile(conn, profile):
+    '''Return a database loaded with the given profile to a safe state. For the bulk profile the
+    database is synced and compacted, which rewrites the whole file, and the connection gets the
+    default cache and temporary storage settings back.
+
+    Args:
+        conn -> Database connection.
+        profile -> One of PROFILES.
+    Returns:
+        Database connection.
+    '''
+    if profile == 'bulk':
+        conn.commit()
+        conn.execute('PRAGMA journal_mode = DELETE')
+        conn.execute('PRAGMA synchronous = FULL')
+        conn.execute('PRAGMA optimize')
+        conn.execute('VACUUM')
+
+        conn.execute('PRAGMA temp_store = DEFAULT')
+        conn.execute('PRAGMA cache_size = {}'.format(DEFAULT_CACHE_SIZE))
+        conn.execute('PRAGMA mmap_size = 0')
+
+    return conn
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import json
+import errno
+import pstats
+import cProfile
+import resource
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from poncho.utils import open_log
+from poncho.utils.get_base_dir import get_base_dir
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    '''Get the peak resident memory in bytes.
+
+    Args:
+        who -> Default: resource.RUSAGE_SELF. resource.RUSAGE_CHILDREN for the peak of the child
+               processes that have finished, e.g. the parse workers.
+    Returns:
+        Peak resident memory in bytes.
+    '''
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def telemetry_path():
+    '''Get the path of the telemetry file of this process in the 'data/logs' directory. All the
+    stages append to the same file; jobs tagged by manage.py each write their own.
+
+    Returns:
+        Path to the telemetry file.
+    '''
+    if open_log.LOG_TAG is None:
+        file_name = 'telemetry.jsonl'
+    else:
+        file_name = 'telemetry_{}.jsonl'.format(open_log.LOG_TAG)
+
+    return os.path.join(get_base_dir(), 'data', 'logs', file_name)
+
+
+class StageTelemetry(object):
+    '''Count the rows and bytes processed by a stage for a timeframe or a year, and append them as
+    JSON lines to the telemetry file. Every line is a JSON object with the following keys:
+        event -> 'progress', 'end' once the stage is done, or 'failed' if it raised an error.
+        stage, timeframe -> Stage and timeframe or year the counts belong to.
+        time -> Local time of the record, in ISO format.
+        elapsed -> Seconds since the stage started on the timeframe.
+        rows_read, rows_accepted, rows_rejected -> Row counts. 'rejected' splits the rejected rows
+                                                   by reason.
+        bytes_read, bytes_written -> Byte counts, where the stage knows them.
+        rows_per_sec, bytes_per_sec -> Average rates since the start.
+        peak_rss, peak_children_rss -> Peak resident memory of this process and of its finished
+                                       child processes, in bytes.
+
+    Usage:
+        with StageTelemetry('createdirtydb', timeframe) as telemetry:
+            telemetry.read(rows, nbytes)
+            telemetry.reject('deleted')
+            telemetry.progress()
+
+    Args:
+        stage -> Name of the stage, e.g. the action of manage.py.
+        timeframe -> Timeframe or year processed.
+        path -> Default: None. Path to the telemetry file. telemetry_path() if None.
+    '''
+    def __init__(self, stage, timeframe, path=None):
+        self.stage = stage
+        self.timeframe = timeframe
+        self.path = path or telemetry_path()
+
+        self.rows_read = 0
+        self.rows_accepted = 0
+        self.rejected = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        self.start = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.write('end' if exc_type is None else 'failed')
+
+    @property
+    def rows_rejected(self):
+        return sum(self.rejected.values())
+
+    def read(self, rows, nbytes=0):
+        '''Count rows read by the stage and the bytes they were read from.'''
+        self.rows_read += rows
+        self.bytes_read += nbytes
+
+    def accept(self, rows=1):
+        '''Count rows kept by the stage.'''
+        self.rows_accepted += rows
+
+    def reject(self, reason, rows=1, accepted=False):
+        '''Count rows thrown away by the stage.
+
+        Args:
+            reason -> Reason the rows were thrown away.
+            rows -> Default: 1. Number of rows.
+            accepted -> Default: False. True if the rows had already been counted as accepted, e.g.
+                        rows refused by the database after passing the filters of the stage.
+        '''
+        if not rows:
+            return
+
+        self.rejected[reason] += rows
+
+        if accepted:
+            self.rows_accepted -= rows
+
+    def reject_all(self, counts):
+        '''Count rows thrown away by the stage for several reasons.
+
+        Args:
+            counts -> Mapping of reasons to numbers of rows.
+        '''
+        self.rejected.update(counts)
+
+    def written(self, nbytes):
+        '''Count bytes written by the stage.'''
+        self.bytes_written += nbytes
+
+    def record(self, event):
+        '''Get the counts as a record of the telemetry file.
+
+        Args:
+            event -> Event the record is written for.
+        Returns:
+            Dictionary of the record.
+        '''
+        elapsed = time.monotonic() - self.start
+
+        return {
+            'event': event,
+            'stage': self.stage,
+            'timeframe': self.timeframe,
+            'time': datetime.now().isoformat(),
+            'elapsed': round(elapsed, 3),
+            'rows_read': self.rows_read,
+            'rows_accepted': self.rows_accepted,
+            'rows_rejected': self.rows_rejected,
+            'rejected': dict(self.rejected),
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'rows_per_sec': round(self.rows_read / elapsed, 1) if elapsed > 0 else None,
+            'bytes_per_sec': round(self.bytes_read / elapsed, 1) if elapsed > 0 else None,
+            'peak_rss': peak_rss(),
+            'peak_children_rss': peak_rss(resource.RUSAGE_CHILDREN),
+        }
+
+    def write(self, event):
+        '''Append a record to the telemetry file.
+
+        Args:
+            event -> Event the record is written for.
+        '''
+        try:
+            os.makedirs(os.path.dirname(self.path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise e
+
+        # A single write of a whole line, so records of processes sharing the file do not interleave.
+        with open(self.path, mode='a', encoding='utf-8') as f:
+            f.write(json.dumps(self.record(event)) + '\n')
+
+    def progress(self):
+        '''Append a progress record to the telemetry file.'''
+        self.write('progress')
+
+
+@contextmanager
+def profiled(name, limit=25):
+    '''Profile the code run in the block with cProfile. The statistics are saved to a '.prof' file
+    in the 'data/logs' directory, which can be read with pstats or tools like snakeviz, and the
+    functions taking the most time are printed. Child processes, e.g. the parse workers, are not
+    profiled.
+
+    Usage:
+        with profiled('createdirtydb'):
+            ...
+
+    Args:
+        name -> Name of the profile, e.g. the stage profiled.
+        limit -> Default: 25. Number of functions printed.
+    '''
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+
+        path = open_log.log_path('profile_{}'.format(name), extension='.prof')
+        profiler.dump_stats(path)
+
+        print('Profile of {} saved to {}.'.format(name, path))
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(limit)
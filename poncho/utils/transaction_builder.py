@@ -1,38 +1,149 @@
-# Global lists to allow for more efficient insertion of data into the database.
-TRANSACTIONS = []
-TRANSACTION_ARGS = []
+import sqlite3
 
 
-def transaction_builder(conn, cur, sql, args):
-    '''Build a transaction and execute SQL statements after 1000 SQL statements have been accumulated.
-    Requires 2 lists: TRANSACTIONS and TRANSACTION_ARGS to be defined.
+class TransactionBuilder(object):
+    '''Accumulate INSERT statements for a database connection and execute them in batches. The
+    queued rows are grouped by statement and each group is inserted with a single executemany
+    call, all inside one transaction. Rows violating a constraint of the table (e.g. a duplicate
+    primary key) are skipped and counted in 'failed'; any other database error is raised.
+
+    Callers that need to know exactly which rows have been committed, e.g. to resume an
+    interrupted load, disable 'autoflush' and call checkpoint after every unit of work; the
+    statement recording their progress is then committed in the same transaction as the rows.
+
+    When used as a context manager, the queued rows are committed at the end of the block, or
+    dropped if it raised an error.
+
+    Usage:
+        with TransactionBuilder(conn) as builder:
+            builder.add(sql, args)
 
     Args:
         conn -> Database connection.
-        cur -> Database cursor.
-        sql -> SQL statement to be executed.
-        args -> Values to be inserted for the corresponding query.
-    Returns:
-        Database connection.
-        Database cursor.
+        batch_size -> Default: 1000. Number of rows after which the queued rows are committed.
+        autoflush -> Default: True. Set to False to only commit the queued rows from checkpoint,
+                     flush and close.
     '''
-    global TRANSACTIONS
-    global TRANSACTION_ARGS
+    def __init__(self, conn, batch_size=1000, autoflush=True):
+        self.conn = conn
+        self.batch_size = batch_size
+        self.autoflush = autoflush
+
+        # Statement recording the progress of the caller, executed at the end of the next transaction.
+        self.marker = None
+
+        # Queued rows for every statement, in the order the statements were first seen.
+        self.statements = {}
+        self.pending = 0
+
+        # Number of rows inserted and rows skipped because of a constraint violation.
+        self.inserted = 0
+        self.failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # If the block raised, the queued rows are dropped rather than committed under the last
+        # checkpoint they are not part of.
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def add(self, sql, args):
+        '''Queue a row to be inserted. The queued rows are committed once 'batch_size' rows have
+        been accumulated.
+
+        Args:
+            sql -> SQL statement to be executed.
+            args -> Values to be inserted for the corresponding query.
+        '''
+        try:
+            self.statements[sql].append(args)
+        except KeyError:
+            self.statements[sql] = [args]
+
+        self.pending += 1
+
+        if self.autoflush and self.pending >= self.batch_size:
+            self.flush()
 
-    TRANSACTIONS.append(sql)
-    TRANSACTION_ARGS.append(args)
+    def checkpoint(self, sql, args):
+        '''Queue a statement recording that all the rows added so far are part of the load, replacing
+        the previously queued one. It is executed after the queued rows, in the same transaction.
+        The queued rows are committed if at least 'batch_size' rows have been accumulated.
 
-    # Execute transaction once the number of queries reaches 1000
-    if len(TRANSACTIONS) > 1000:
-        cur.execute('BEGIN TRANSACTION')
+        Args:
+            sql -> SQL statement to be executed.
+            args -> Values of the statement.
+        '''
+        self.marker = (sql, args)
+
+        if self.pending >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Insert all the queued rows in a single transaction and commit it. If a row of the batch
+        violates a constraint, the transaction is rolled back and the batch is inserted row by row,
+        skipping the offending rows.
+        '''
+        if not self.pending and self.marker is None:
+            return
+
+        cur = self.conn.cursor()
+
+        try:
+            for sql, rows in self.statements.items():
+                cur.executemany(sql, rows)
+
+            if self.marker is not None:
+                cur.execute(*self.marker)
+
+            self.conn.commit()
+            self.inserted += self.pending
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+
+            inserted, failed = self.inserted, self.failed
 
-        for trans, args in zip(TRANSACTIONS, TRANSACTION_ARGS):
             try:
-                cur.execute(trans, args)
+                for sql, rows in self.statements.items():
+                    for args in rows:
+                        try:
+                            cur.execute(sql, args)
+                            self.inserted += 1
+                        except sqlite3.IntegrityError:
+                            self.failed += 1
+
+                if self.marker is not None:
+                    cur.execute(*self.marker)
+
+                self.conn.commit()
             except Exception:
-                pass
+                # Keep the rows queued and the counts unchanged so that the caller may retry.
+                self.conn.rollback()
+                self.inserted, self.failed = inserted, failed
+                raise
+        except Exception:
+            # Keep the rows queued so that the caller may retry.
+            self.conn.rollback()
+            raise
+        finally:
+            cur.close()
+
+        self.statements = {}
+        self.pending = 0
+        self.marker = None
+
+    def discard(self):
+        '''Drop the queued rows and checkpoint and roll back the current transaction.'''
+        self.conn.rollback()
 
-        conn.commit()
-        TRANSACTIONS, TRANSACTION_ARGS = [], []
+        self.statements = {}
+        self.pending = 0
+        self.marker = None
 
-    return conn, cur
+    def close(self):
+        '''Commit the rows that are still queued. The connection itself is left open.'''
+        self.flush()